@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""Benchmark offline del bot: nessuna chiamata verso Telegram o Internet.
+
+Avvia in locale:
+- una finta Bot API (getMe, sendMessage, editMessageText, answerCallbackQuery);
+- uno stub di telegram.me che serve le pagine salvate in ``fixtures/telegram_me``
+  con latenza configurabile;
+
+poi invia al bot update sintetici (/cerca, /info e bottoni) e riporta
+throughput, latenze p50/p95/p99 per scenario e velocita' di scrittura su SQLite.
+
+Esempi:
+    python benchmark.py --requests 2000 --concurrency 64 --save baseline.json
+    python benchmark.py --requests 2000 --compare baseline.json
+    python benchmark.py --parse
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from aiohttp import web
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures' / 'telegram_me'
+BENCH_TOKEN = '123456:BENCHMARK'
+
+def configure_environment(args):
+    """Da chiamare prima di importare bot: la configurazione viene letta all'import"""
+    db_dir = tempfile.mkdtemp(prefix='bot-bench-')
+    os.environ['DB_FILE'] = os.path.join(db_dir, 'bench.db')
+    os.environ['TELEGRAM_ME_URL'] = f"http://127.0.0.1:{args.stub_port}"
+    os.environ['BOT_TOKEN'] = BENCH_TOKEN
+    # I limiti anti-flood reali renderebbero il benchmark una misura dei token bucket
+    os.environ.setdefault('OUTBOUND_GLOBAL_RATE', '100000')
+    os.environ.setdefault('OUTBOUND_CHAT_RATE', '100000')
+    os.environ.setdefault('OUTBOUND_GROUP_RATE', '100000')
+    os.environ.setdefault('SOURCE_RATE', '100000')
+    os.environ.setdefault('SOURCE_BURST', '100000')
+    os.environ.setdefault('LOADING_DELAY', str(args.loading_delay))
+    return db_dir
+
+def load_fixtures():
+    """Pagine salvate e risultati attesi dal parser"""
+    expected = json.loads((FIXTURES_DIR / 'expected.json').read_text(encoding='utf-8'))
+    pages = {name: (FIXTURES_DIR / name).read_text(encoding='utf-8') for name in expected}
+    return pages, expected
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies, elapsed):
+    return {
+        'count': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+class DirectoryStub:
+    """Finto telegram.me: GET /s/<nome> restituisce una delle pagine salvate.
+
+    La pagina e' scelta in modo deterministico dal nome, e lo username della
+    fixture viene sostituito con quello richiesto cosi' ogni query produce
+    gruppi distinti.
+    """
+    def __init__(self, pages, expected, latency=0.05, jitter=0.02, padding=0, error_rate=0.0):
+        self.pages = []
+        for name, html in sorted(pages.items()):
+            usernames = [card['username'] for card in expected[name] if card['username']]
+            self.pages.append((html, usernames[0] if usernames else None))
+        self.latency = latency
+        self.jitter = jitter
+        self.padding = ' ' * padding
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        name = request.match_info['name']
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text='Service Unavailable')
+        html, username = self.pages[zlib.crc32(name.encode()) % len(self.pages)]
+        if username:
+            html = html.replace(username, name)
+        # Il padding finisce dopo le schede: misura quanto il parser si ferma prima
+        return web.Response(text=html + self.padding, content_type='text/html', charset='utf-8')
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/s/{name}', self.handle)
+        return app
+
+class FakeBotAPI:
+    """Finta Bot API: risponde come Telegram ai metodi usati dal bot e li conta"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+
+    def _message(self, params):
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': int(params.get('message_id') or next(self.message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': {'id': 123456, 'is_bot': True, 'first_name': 'Bench'},
+            'text': params.get('text', ''),
+        }
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                      'can_join_groups': True, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': True}
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(params)
+        elif method in ('answerCallbackQuery', 'answerInlineQuery', 'deleteMessage'):
+            result = True
+        else:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        return web.json_response({'ok': True, 'result': result})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+class UpdateFactory:
+    """Genera update sintetici: molti utenti, query con distribuzione Zipf"""
+    COMMAND_WORDS = ['crypto', 'bitcoin', 'milano', 'roma', 'napoli', 'calcio', 'gaming', 'python',
+                     'cucina', 'fotografia', 'musica', 'cinema', 'lavoro', 'viaggi', 'auto', 'libri',
+                     'anime', 'fitness', 'trading', 'universita', 'appunti', 'offerte', 'serie', 'moda']
+
+    def __init__(self, bot_module, users=500, vocabulary=200, zipf=1.1, seed=42):
+        self.bot_module = bot_module
+        self.random = random.Random(seed)
+        self.users = users
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        words = list(self.COMMAND_WORDS)
+        while len(words) < vocabulary:
+            words.append(f"{self.random.choice(self.COMMAND_WORDS)}{len(words)}")
+        self.vocabulary = words[:vocabulary]
+        weights = [1 / (rank ** zipf) for rank in range(1, len(self.vocabulary) + 1)]
+        total = sum(weights)
+        self.cumulative = list(itertools.accumulate(w / total for w in weights))
+
+    def _word(self):
+        index = bisect.bisect_left(self.cumulative, self.random.random())
+        return self.vocabulary[min(index, len(self.vocabulary) - 1)]
+
+    def _user(self):
+        user_id = self.random.randint(1, self.users)
+        return {'id': user_id, 'is_bot': False, 'first_name': f"Utente{user_id}"}, user_id
+
+    def _command(self, text):
+        user, chat_id = self._user()
+        command = text.split()[0]
+        return {
+            'update_id': next(self.update_ids),
+            'message': {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': user,
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+            },
+        }
+
+    def _callback(self, data):
+        user, chat_id = self._user()
+        return {
+            'update_id': next(self.update_ids),
+            'callback_query': {
+                'id': str(next(self.update_ids)),
+                'from': user,
+                'chat_instance': str(chat_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self.message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': 123456, 'is_bot': True, 'first_name': 'Bench'},
+                    'text': 'menu',
+                },
+            },
+        }
+
+    def make(self, scenario):
+        encode = self.bot_module.encode_callback
+        if scenario == 'search':
+            return self._command(f"/cerca {self._word()}")
+        if scenario == 'info':
+            return self._command(f"/info @{self._word()}")
+        # Bottoni che non dipendono da id internati: aiuto, trending e categorie
+        choice = self.random.randrange(3)
+        if choice == 0:
+            return self._callback(encode('help'))
+        if choice == 1:
+            return self._callback(encode('trending'))
+        return self._callback(encode('cat', self.random.randrange(len(self.bot_module.CATEGORIES))))
+
+async def start_site(app, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+async def run_load(args, bot_module):
+    from telegram import Bot, Update
+    from telegram.ext import Application
+
+    pages, expected = load_fixtures()
+    stub = DirectoryStub(pages, expected, args.latency, args.jitter, args.padding, args.error_rate)
+    fake_api = FakeBotAPI(args.api_latency)
+    runners = [await start_site(stub.app(), args.stub_port), await start_site(fake_api.app(), args.api_port)]
+
+    application = (
+        Application.builder()
+        .bot(Bot(BENCH_TOKEN, base_url=f"http://127.0.0.1:{args.api_port}/bot"))
+        .concurrent_updates(bot_module.ChatOrderedUpdateProcessor())
+        .build()
+    )
+    bot_module.register_handlers(application)
+    await application.initialize()
+    await bot_module.on_startup(application)
+
+    factory = UpdateFactory(bot_module, args.users, args.vocabulary, args.zipf, args.seed)
+    mix = [('search', args.mix_search), ('info', args.mix_info), ('callback', args.mix_callback)]
+    scenarios = [name for name, weight in mix for _ in range(weight)]
+    plan = [factory.random.choice(scenarios) for _ in range(args.requests)]
+
+    latencies = defaultdict(list)
+    limit = asyncio.Semaphore(args.concurrency)
+    processor = application.update_processor
+
+    async def drive(scenario):
+        update = Update.de_json(factory.make(scenario), application.bot)
+        async with limit:
+            started = time.perf_counter()
+            await processor.process_update(update, application.process_update(update))
+            latencies[scenario].append(time.perf_counter() - started)
+
+    rows_before = bot_module.write_queue.rows_written
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(scenario) for scenario in plan))
+    elapsed = time.perf_counter() - started
+    # Le scritture rimaste in coda fanno parte del costo misurato
+    flush_started = time.perf_counter()
+    await bot_module.write_queue.flush()
+    flush_elapsed = time.perf_counter() - flush_started
+    rows_written = bot_module.write_queue.rows_written - rows_before
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+        'elapsed_s': round(elapsed, 3),
+        'total': summarize([l for values in latencies.values() for l in values], elapsed),
+        'scenarios': {name: summarize(values, elapsed) for name, values in sorted(latencies.items())},
+        'db': {
+            'rows_written': rows_written,
+            'rows_per_s': round(rows_written / (elapsed + flush_elapsed), 1) if rows_written else 0.0,
+            'final_flush_ms': round(flush_elapsed * 1000, 2),
+        },
+        'cache': bot_module.search_cache.stats(),
+        'sources': bot_module.searcher.get_source_stats(),
+        'processor': processor.stats(),
+        'outbox': bot_module.outbox.stats(),
+        'bot_api_calls': dict(fake_api.calls),
+        'stub': {'requests': stub.requests, 'errors': stub.errors},
+    }
+
+    await bot_module.on_shutdown(application)
+    await application.shutdown()
+    for runner in runners:
+        await runner.cleanup()
+    return report
+
+def parse_page(bot_module, data, chunk_size):
+    """Come search_telegram_me: feed a chunk, fermandosi appena il parser ha finito"""
+    parser = bot_module.TelegramCardParser(5)
+    parsed = 0
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        parser.feed(chunk)
+        parsed += len(chunk)
+        if parser.done:
+            break
+    else:
+        parser.close()
+    return parser, parsed
+
+def run_parse(args, bot_module):
+    """Micro-benchmark del parser sulle pagine salvate, con verifica dei risultati attesi"""
+    pages, expected = load_fixtures()
+    report = {'config': {'iterations': args.iterations, 'parse_chunk': args.parse_chunk}, 'pages': {}}
+    failures = []
+    for name, html in sorted(pages.items()):
+        padded = html + ' ' * args.padding
+        timings = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            parser, parsed = parse_page(bot_module, padded, args.parse_chunk)
+            timings.append(time.perf_counter() - started)
+        # Ogni pagina ha una sola scheda: il parser deve fermarsi appena si chiude
+        if parser.results != expected[name] or not parser.done:
+            failures.append(name)
+        report['pages'][name] = {
+            'bytes': len(padded),
+            'parsed_bytes': parsed,
+            'p50_us': round(percentile(timings, 50) * 1e6, 1),
+            'p99_us': round(percentile(timings, 99) * 1e6, 1),
+            'ok': name not in failures,
+        }
+    report['failures'] = failures
+    return report
+
+def compare(report, baseline, path=()):
+    """Differenze percentuali rispetto a un report salvato (solo valori numerici)"""
+    lines = []
+    for key, value in report.items():
+        if key == 'config':
+            continue
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            lines.extend(compare(value, old or {}, path + (key,)))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(old, (int, float)):
+            delta = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            lines.append(f"{'.'.join(path + (key,))}: {old} -> {value} ({delta})")
+    return lines
+
+def print_report(report):
+    print(json.dumps({key: value for key, value in report.items() if key != 'config'}, indent=2, ensure_ascii=False))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del Bot Ricerca Gruppi")
+    parser.add_argument('--parse', action='store_true', help="Misura solo il parser HTML sulle fixture")
+    parser.add_argument('--iterations', type=int, default=2000, help="Ripetizioni per pagina con --parse")
+    parser.add_argument('--parse-chunk', type=int, default=1024, help="Caratteri per feed con --parse")
+    parser.add_argument('--requests', type=int, default=1000, help="Update sintetici da inviare")
+    parser.add_argument('--concurrency', type=int, default=64, help="Update in volo contemporaneamente")
+    parser.add_argument('--users', type=int, default=500, help="Utenti (e chat) distinti")
+    parser.add_argument('--vocabulary', type=int, default=200, help="Query distinte")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Esponente Zipf delle query")
+    parser.add_argument('--mix-search', type=int, default=6, help="Peso dello scenario /cerca")
+    parser.add_argument('--mix-info', type=int, default=2, help="Peso dello scenario /info")
+    parser.add_argument('--mix-callback', type=int, default=2, help="Peso dello scenario bottoni")
+    parser.add_argument('--latency', type=float, default=0.05, help="Latenza dello stub telegram.me (s)")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Variazione casuale della latenza (s)")
+    parser.add_argument('--padding', type=int, default=0, help="Byte extra in coda a ogni pagina")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Frazione di risposte 503 dallo stub")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Latenza della finta Bot API (s)")
+    parser.add_argument('--loading-delay', type=float, default=0.4, help="LOADING_DELAY del bot (s)")
+    parser.add_argument('--stub-port', type=int, default=18081, help="Porta dello stub telegram.me")
+    parser.add_argument('--api-port', type=int, default=18082, help="Porta della finta Bot API")
+    parser.add_argument('--seed', type=int, default=42, help="Seme per update riproducibili")
+    parser.add_argument('--save', help="Salva il report JSON in questo file")
+    parser.add_argument('--compare', help="Confronta con un report JSON salvato")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    db_dir = configure_environment(args)
+    import bot as bot_module
+    # Una riga di log per ogni chiamata alla finta Bot API falserebbe le misure
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    try:
+        if args.parse:
+            report = run_parse(args, bot_module)
+        else:
+            report = asyncio.run(run_load(args, bot_module))
+    finally:
+        bot_module.db.close()
+        for name in os.listdir(db_dir):
+            os.remove(os.path.join(db_dir, name))
+        os.rmdir(db_dir)
+
+    print_report(report)
+    if args.save:
+        Path(args.save).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"💾 Report salvato in {args.save}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        print(f"\n📊 Confronto con {args.compare}:")
+        for line in compare(report, baseline):
+            print(f"  {line}")
+    if args.parse and report['failures']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
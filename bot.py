@@ -1,16 +1,39 @@
 import os
+import argparse
 import logging
 import asyncio
 import aiohttp
+import base64
+import binascii
+import bisect
+import contextlib
+import contextvars
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import signal
+from aiohttp import web
+import codecs
+import itertools
 import json
+import math
+import random
 import re
-from datetime import datetime
+import sys
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 import sqlite3
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot, InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, InlineQueryHandler
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.error import RetryAfter, TelegramError
 import urllib.parse
+from html.parser import HTMLParser
 
 # Configurazione logging
 logging.basicConfig(
@@ -19,120 +42,1711 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+try:
+    import brotli  # noqa: F401 - se presente aiohttp decomprime le risposte 'br'
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
 # Token del bot
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Pool di connessioni HTTP condiviso da tutte le fonti
+HTTP_LIMIT = int(os.getenv('HTTP_LIMIT', '100'))
+HTTP_LIMIT_PER_HOST = int(os.getenv('HTTP_LIMIT_PER_HOST', '10'))
+HTTP_KEEPALIVE = float(os.getenv('HTTP_KEEPALIVE', '30'))
+HTTP_DNS_TTL = int(os.getenv('HTTP_DNS_TTL', '300'))
+HTTP_TIMEOUT_TOTAL = float(os.getenv('HTTP_TIMEOUT_TOTAL', '10'))
+HTTP_TIMEOUT_CONNECT = float(os.getenv('HTTP_TIMEOUT_CONNECT', '3'))
+HTTP_TIMEOUT_READ = float(os.getenv('HTTP_TIMEOUT_READ', '5'))
+HTTP_COMPRESSION = os.getenv('HTTP_COMPRESSION', '1') == '1'
+# Base delle anteprime pubbliche t.me (sovrascrivibile, es. per il benchmark offline)
+TELEGRAM_ME_URL = os.getenv('TELEGRAM_ME_URL', 'https://telegram.me').rstrip('/')
+HTTP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# Dimensione dei chunk letti dalle pagine HTML durante il parsing incrementale
+PARSE_CHUNK_SIZE = int(os.getenv('PARSE_CHUNK_SIZE', '16384'))
+
+# Modalita' di ricezione degli update: 'polling' oppure 'webhook' (dyno web del Procfile)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+BOT_MODE = os.getenv('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook').strip('/')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+PORT = int(os.getenv('PORT', '8443'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or (
+    hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32] if BOT_TOKEN else None)
+
+# Solo gli update gestiti dagli handler
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+# Elaborazione concorrente degli update: UPDATE_WORKERS handler in parallelo,
+# al massimo MAX_PENDING_UPDATES update accettati (in esecuzione + in coda), oltre si risponde "occupato"
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '256'))
+
+# Rate limit (token bucket) e circuit breaker per ogni fonte
+SOURCE_RATE = float(os.getenv('SOURCE_RATE', '5'))
+SOURCE_BURST = int(os.getenv('SOURCE_BURST', '10'))
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', '30'))
+
+# Invii verso Telegram: limiti globali e per chat (i gruppi hanno limiti piu' stretti)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '28'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', '0.33'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+# Il messaggio "caricamento" si invia solo se il risultato tarda piu' di LOADING_DELAY secondi
+LOADING_DELAY = float(os.getenv('LOADING_DELAY', '0.4'))
+
+# Timeout (secondi) per ogni fonte di ricerca e deadline complessiva di /cerca.
+# Con SEARCH_DEADLINE > 0 si restituisce cio' che e' pronto entro la deadline.
+SOURCE_TIMEOUT = float(os.getenv('SOURCE_TIMEOUT', '5'))
+SOURCE_TIMEOUTS = {
+    'telegram_me': float(os.getenv('TIMEOUT_TELEGRAM_ME', SOURCE_TIMEOUT)),
+    'tlgrm_eu': float(os.getenv('TIMEOUT_TLGRM_EU', SOURCE_TIMEOUT)),
+    'tgstat': float(os.getenv('TIMEOUT_TGSTAT', SOURCE_TIMEOUT)),
+}
+SEARCH_DEADLINE = float(os.getenv('SEARCH_DEADLINE', '6'))
+
+# Cache dei risultati: LRU in memoria (fresca per CACHE_TTL, servita stantia fino a
+# CACHE_STALE_TTL mentre si aggiorna in background) e SQLite come secondo livello
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '1000'))
+CACHE_TTL = float(os.getenv('CACHE_TTL', '300'))
+CACHE_STALE_TTL = float(os.getenv('CACHE_STALE_TTL', '1800'))
+DB_CACHE_TTL = float(os.getenv('DB_CACHE_TTL', '3600'))
+
+# Viste precalcolate di trending e categorie, aggiornate ogni AGGREGATE_INTERVAL secondi
+AGGREGATE_INTERVAL = float(os.getenv('AGGREGATE_INTERVAL', '300'))
+TRENDING_WINDOW_DAYS = int(os.getenv('TRENDING_WINDOW_DAYS', '7'))
+VIEW_SIZE = int(os.getenv('VIEW_SIZE', '10'))
+
+# Categorie dei bottoni /categorie: etichetta e parole chiave
+CATEGORIES = {
+    'crypto': ("💰 Crypto", ('crypto', 'bitcoin', 'btc', 'eth', 'ethereum', 'blockchain', 'trading', 'nft')),
+    'tech': ("💻 Tech", ('tech', 'tecnologia', 'programmazione', 'python', 'linux', 'android', 'sviluppo')),
+    'gaming': ("🎮 Gaming", ('gaming', 'game', 'games', 'giochi', 'videogiochi', 'playstation', 'xbox', 'nintendo')),
+    'studio': ("📚 Studio", ('studio', 'università', 'universita', 'scuola', 'esami', 'appunti', 'studenti')),
+    'citta': ("🏙️ Città", ('città', 'citta', 'milano', 'roma', 'napoli', 'torino', 'firenze', 'bologna', 'palermo')),
+    'food': ("🍕 Food", ('food', 'cucina', 'ricette', 'pizza', 'ristoranti')),
+    'sport': ("⚽ Sport", ('sport', 'calcio', 'fantacalcio', 'basket', 'tennis', 'palestra')),
+    'musica': ("🎵 Musica", ('musica', 'music', 'rap', 'rock', 'concerti')),
+    'cinema': ("🎬 Cinema", ('cinema', 'film', 'serie', 'netflix', 'movie')),
+    'auto': ("🚗 Auto", ('auto', 'motori', 'moto', 'formula1', 'f1')),
+}
+
+# Paginazione dei risultati di /cerca: pagine da RESULTS_PER_PAGE, insiemi di
+# risultati tenuti in memoria per RESULT_PAGES_TTL secondi (al massimo RESULT_PAGES_SIZE)
+RESULTS_PER_PAGE = int(os.getenv('RESULTS_PER_PAGE', '8'))
+RESULT_PAGES_SIZE = int(os.getenv('RESULT_PAGES_SIZE', '2000'))
+RESULT_PAGES_TTL = float(os.getenv('RESULT_PAGES_TTL', '900'))
+
+# Modalita' inline (@bot <testo>): indice dei prefissi in memoria
+# Ogni gruppo indicizzato costa qualche KB di RAM (circa 100 prefissi)
+INLINE_INDEX_SIZE = int(os.getenv('INLINE_INDEX_SIZE', '20000'))
+INLINE_RESULTS = int(os.getenv('INLINE_RESULTS', '10'))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '30'))
+
+# Database SQLite
+DB_FILE = os.getenv('DB_FILE', 'groups_search.db')
+DB_CACHE_KB = int(os.getenv('DB_CACHE_KB', '16384'))
+
+# Scritture differite: flush ogni WRITE_BATCH_SIZE righe o WRITE_FLUSH_INTERVAL secondi
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '200'))
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', '2'))
+# Righe massime in attesa (oltre vengono scartate) e tentativi prima di isolare le righe difettose
+WRITE_MAX_PENDING = int(os.getenv('WRITE_MAX_PENDING', '20000'))
+WRITE_MAX_RETRIES = int(os.getenv('WRITE_MAX_RETRIES', '3'))
+
+# Peso del numero di membri nel ranking full-text (si somma al punteggio BM25)
+FTS_MEMBERS_WEIGHT = float(os.getenv('FTS_MEMBERS_WEIGHT', '0.5'))
+
+# Metriche in formato Prometheus su http://METRICS_LISTEN:METRICS_PORT/metrics (0 = disattivate)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+# Tracing: frazione di richieste tracciate (0 = spento), span lenti loggati oltre TRACE_SLOW_MS
+TRACE_SAMPLE = float(os.getenv('TRACE_SAMPLE', '0'))
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '1000'))
+TRACE_BUFFER = int(os.getenv('TRACE_BUFFER', '1000'))
+
+def _members_log(value):
+    """log(1 + membri), tollerante a valori non numerici"""
+    try:
+        return math.log1p(max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return 0.0
+
+def normalize_group_key(group_username, invite_link='', group_name=''):
+    """Identita' canonica di un gruppo: username minuscolo, poi link t.me, poi nome"""
+    username = (group_username or '').strip().lstrip('@').lower()
+    if username:
+        return username
+    link = (invite_link or '').strip()
+    match = re.search(r'(?:t\.me|telegram\.me)/([^?#]+)', link)
+    if match:
+        path = match.group(1).strip('/')
+        # Gli hash di invito sono case-sensitive, gli username no
+        if path.startswith('+') or path.lower().startswith('joinchat/'):
+            return f"invite:{path.split('/')[-1].lstrip('+')}"
+        return path.lower()
+    name = (group_name or '').strip().lower()
+    return f"name:{name}" if name else None
+
+def parse_members(value):
+    """Converte un numero di membri ("5.2K", "1,2M", "12 345", 800) in intero; None se ignoto"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().replace(' ', '').replace('\u00a0', '').upper()
+    match = re.fullmatch(r'([\d.,]+)([KM]?)', text)
+    if not match:
+        return None
+    number, suffix = match.groups()
+    if suffix:
+        number = number.replace(',', '.')
+    else:
+        number = number.replace(',', '').replace('.', '')
+    try:
+        amount = float(number)
+    except ValueError:
+        return None
+    return int(round(amount * {'': 1, 'K': 1_000, 'M': 1_000_000}[suffix]))
+
+def format_members(value):
+    """Formato compatto per la visualizzazione: 5200 -> 5.2K"""
+    count = parse_members(value)
+    if count is None:
+        return 'N/A'
+    if count >= 1_000_000:
+        return f"{count / 1_000_000:.1f}".rstrip('0').rstrip('.') + 'M'
+    if count >= 1_000:
+        return f"{count / 1_000:.1f}".rstrip('0').rstrip('.') + 'K'
+    return str(count)
+
+def parse_search_args(args):
+    """Separa i termini di /cerca dai filtri min:<n> e max:<n>"""
+    terms = []
+    min_members = max_members = None
+    for arg in args:
+        key, _, value = arg.partition(':')
+        if key.lower() in ('min', 'max') and parse_members(value) is not None:
+            if key.lower() == 'min':
+                min_members = parse_members(value)
+            else:
+                max_members = parse_members(value)
+        else:
+            terms.append(arg)
+    return " ".join(terms), min_members, max_members
+
+def row_to_result(group_name, group_username, group_description, members_count, invite_link):
+    """Riga di searched_groups nel formato dei risultati delle fonti web"""
+    return {
+        'title': group_name,
+        'username': group_username,
+        'description': group_description,
+        'members': members_count,
+        'link': invite_link
+    }
+
+def filter_members(results, min_members=None, max_members=None):
+    """Risultati con numero di membri noto ed entro i limiti (stessa regola di _members_filter)"""
+    filtered = []
+    for result in results:
+        members = parse_members(result.get('members'))
+        if members is None:
+            continue
+        if min_members is not None and members < min_members:
+            continue
+        if max_members is not None and members > max_members:
+            continue
+        filtered.append(result)
+    return filtered
+
+def merge_results(first, second, limit):
+    """Unisce due liste di risultati senza duplicati (per group_key), mantenendo l'ordine"""
+    seen = set()
+    merged = []
+    for result in itertools.chain(first, second):
+        key = normalize_group_key(result.get('username', ''), result.get('link', ''), result.get('title', ''))
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        merged.append(result)
+    return merged[:limit]
+
+def classify_group(*texts):
+    """Categorie (chiavi di CATEGORIES) a cui appartiene un gruppo, per parole chiave"""
+    tokens = set()
+    for text in texts:
+        tokens.update(re.findall(r'\w+', (text or '').lower()))
+    return [key for key, (_, keywords) in CATEGORIES.items() if tokens.intersection(keywords)]
+
+def normalize_query(search_query):
+    """Forma canonica di una query: minuscola, spazi compressi"""
+    return ' '.join(search_query.lower().split())
+
+def fts_match_expression(search_query):
+    """Converte una query utente in un'espressione MATCH FTS5 (AND di prefissi)"""
+    tokens = re.findall(r'\w+', search_query.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+# Limiti superiori (secondi) dei bucket degli istogrammi di latenza
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Istogramma a bucket fissi; i conteggi diventano cumulativi solo all'export"""
+    __slots__ = ('buckets', 'counts', 'sum')
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class Metrics:
+    """Registro di metriche esportate in formato testo Prometheus.
+    
+    Istogrammi e contatori vengono aggiornati sul percorso caldo (una ricerca
+    in un dict per osservazione); gauge e contatori gia' tenuti dalle varie
+    ``stats()`` vengono letti solo quando /metrics viene interrogato.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.descriptions = {}
+        self.histograms = {}
+        self.counters = {}
+    
+    def describe(self, name, kind, text):
+        self.descriptions[name] = (kind, text)
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + amount
+    
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+    
+    def _header(self, lines, name, kind, text=None):
+        kind, text = self.descriptions.get(name, (kind, text or name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+    
+    def render(self, collected=()):
+        """Testo per /metrics; ``collected`` sono tuple (nome, tipo, descrizione, [(labels, valore)])"""
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            self._header(lines, name, 'histogram')
+            for labels, histogram in by_name[name]:
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                cumulative += histogram.counts[-1]
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        
+        by_name = {}
+        for (name, labels), value in list(self.counters.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            self._header(lines, name, 'counter')
+            for labels, value in by_name[name]:
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        
+        for name, kind, text, samples in collected:
+            self._header(lines, name, kind, text)
+            for labels, value in samples:
+                lines.append(f"{name}{self._labels(labels.items())} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('bot_handler_seconds', 'histogram', "Durata degli handler di comandi, bottoni e query inline")
+metrics.describe('bot_source_seconds', 'histogram', "Durata delle richieste alle fonti web")
+metrics.describe('bot_db_query_seconds', 'histogram', "Tempo di esecuzione delle operazioni SQLite nel thread dedicato")
+metrics.describe('bot_outbound_seconds', 'histogram', "Durata delle chiamate di invio verso la Bot API")
+metrics.describe('bot_errors_total', 'counter', "Errori per punto di origine")
+
+# Span attivo nel task corrente: i task figli (create_task) lo ereditano
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Tracer:
+    """Tracing a campione degli hot path.
+    
+    La decisione di campionamento si prende sullo span radice (un handler):
+    per le richieste non campionate ``span()`` costa una lettura di
+    ContextVar e un numero casuale. Gli span completati finiscono in un
+    buffer circolare esposto su /traces; quelli oltre ``slow_ms`` vengono loggati.
+    """
+    def __init__(self, sample=TRACE_SAMPLE, slow_ms=TRACE_SLOW_MS, buffer=TRACE_BUFFER):
+        self.sample = sample
+        self.slow_ms = slow_ms
+        self.spans = deque(maxlen=buffer)
+    
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        parent = _current_span.get()
+        if parent is None and (not self.sample or random.random() >= self.sample):
+            yield None
+            return
+        
+        span = {
+            'trace_id': parent['trace_id'] if parent else f"{random.getrandbits(64):016x}",
+            'span_id': f"{random.getrandbits(64):016x}",
+            'parent_id': parent['span_id'] if parent else None,
+            'name': name,
+            'start': time.time(),
+            'attrs': attrs,
+        }
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span['error'] = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            span['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self.spans.append(span)
+            if span['duration_ms'] >= self.slow_ms:
+                logger.warning(f"Span lento {name} ({span['duration_ms']} ms) trace={span['trace_id']} {attrs}")
+
+tracer = Tracer()
+
+@contextlib.contextmanager
+def observe_handler(name):
+    """Misura un handler (istogramma + span radice) e conta le eccezioni"""
+    start = time.perf_counter()
+    with tracer.span(f"handler.{name}"):
+        try:
+            yield
+        except Exception:
+            metrics.inc('bot_errors_total', where=name)
+            raise
+        finally:
+            metrics.observe('bot_handler_seconds', time.perf_counter() - start, handler=name)
+
+def timed_handler(name, callback):
+    """Avvolge un callback PTB con observe_handler"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with observe_handler(name):
+            return await callback(update, context)
+    return wrapper
+
 class GroupSearchDB:
-    def __init__(self, db_file='groups_search.db'):
+    """Connessione SQLite persistente, usata da un unico thread dedicato.
+    
+    I metodi sincroni sono protetti da un lock; dai handler asyncio vanno
+    chiamati con ``await db.run(db.metodo, ...)`` per non bloccare l'event loop.
+    """
+    INSERT_GROUP_SQL = '''
+        INSERT INTO searched_groups 
+        (group_key, group_name, group_username, group_description, members_count, 
+         group_type, invite_link, search_query, found_date, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?9)
+        ON CONFLICT(group_key) DO UPDATE SET
+            group_name = excluded.group_name,
+            group_description = COALESCE(NULLIF(excluded.group_description, ''), group_description),
+            members_count = COALESCE(excluded.members_count, members_count),
+            invite_link = COALESCE(NULLIF(excluded.invite_link, ''), invite_link),
+            search_query = excluded.search_query,
+            last_seen = excluded.last_seen
+    '''
+    # Colonne di searched_groups in import/export (l'id resta locale al database)
+    CATALOG_COLUMNS = (
+        'group_key', 'group_name', 'group_username', 'group_description', 'members_count',
+        'group_type', 'invite_link', 'search_query', 'found_date', 'last_seen', 'is_verified',
+    )
+    FTS_TRIGGERS = ('searched_groups_fts_ai', 'searched_groups_fts_ad', 'searched_groups_fts_au')
+    GROUP_INDEXES = (
+        'idx_searched_groups_key', 'idx_searched_groups_query',
+        'idx_searched_groups_rank', 'idx_searched_groups_seen', 'idx_searched_groups_page',
+    )
+    # Quali gruppi ha restituito ciascuna query: search_query in searched_groups
+    # tiene solo l'ultima query che ha trovato il gruppo
+    INSERT_QUERY_RESULT_SQL = '''
+        INSERT INTO query_results (search_query, group_key, seen) VALUES (?, ?, ?)
+        ON CONFLICT(search_query, group_key) DO UPDATE SET seen = excluded.seen
+    '''
+    # Oltre queste corrispondenze FTS le query ordinate per membri scorrono l'indice
+    FTS_SCAN_LIMIT = 10000
+    INSERT_SEARCH_SQL = '''
+        INSERT INTO search_history 
+        (user_id, search_query, results_count, search_date)
+        VALUES (?, ?, ?, ?)
+    '''
+    
+    def __init__(self, db_file=DB_FILE):
         self.db_file = db_file
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.conn = self._connect()
         self.init_db()
     
+    def _connect(self):
+        # cached_statements mantiene compilate le query ripetute (prepared statements)
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_KB}')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.create_function('members_log', 1, _members_log, deterministic=True)
+        return conn
+    
+    async def run(self, func, *args, **kwargs):
+        """Esegue un metodo del database nel thread dedicato"""
+        loop = asyncio.get_running_loop()
+        name = func.__name__
+
+        def timed():
+            # Solo il tempo di esecuzione: l'attesa in coda resta nello span
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe('bot_db_query_seconds', time.perf_counter() - start, op=name)
+
+        with tracer.span(f"db.{name}"):
+            return await loop.run_in_executor(self._executor, timed)
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            if self.conn:
+                self.conn.execute('PRAGMA optimize')
+                self.conn.close()
+                self.conn = None
+    
     def init_db(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS searched_groups (
-                id INTEGER PRIMARY KEY,
-                group_name TEXT,
-                group_username TEXT,
-                group_description TEXT,
-                members_count INTEGER,
-                group_type TEXT,
-                invite_link TEXT,
-                search_query TEXT,
-                found_date DATETIME,
-                is_verified INTEGER DEFAULT 0
-            )
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS searched_groups (
+                    id INTEGER PRIMARY KEY,
+                    group_name TEXT,
+                    group_username TEXT,
+                    group_description TEXT,
+                    members_count INTEGER,
+                    group_type TEXT,
+                    invite_link TEXT,
+                    search_query TEXT,
+                    found_date DATETIME,
+                    is_verified INTEGER DEFAULT 0,
+                    group_key TEXT,
+                    last_seen DATETIME
+                )
+            ''')
+            
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_history (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    search_query TEXT,
+                    results_count INTEGER,
+                    search_date DATETIME
+                )
+            ''')
+        self._migrate_group_key()
+        self._migrate_members()
+        self.fts_enabled = self._init_fts()
+        # Prima della compattazione: ogni duplicato porta una coppia query -> gruppo
+        self._init_query_results()
+        self._ensure_unique_key()
+        self._create_indexes()
+        self._init_aggregates()
+        self._init_favorites()
+    
+    def _init_favorites(self):
+        """Preferiti degli utenti e stringhe referenziate dai bottoni (callback_data)"""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS callback_strings (
+                    id INTEGER PRIMARY KEY,
+                    value TEXT UNIQUE
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS favorites (
+                    user_id INTEGER,
+                    kind TEXT,
+                    value TEXT,
+                    saved_date DATETIME,
+                    PRIMARY KEY (user_id, kind, value)
+                )
+            ''')
+    
+    def _init_query_results(self):
+        """Associazione query -> gruppi per il livello SQLite della cache di ricerca"""
+        with self._lock, self.conn:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'query_results'"
+            ).fetchone()
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_results (
+                    search_query TEXT,
+                    group_key TEXT,
+                    seen DATETIME,
+                    PRIMARY KEY (search_query, group_key)
+                ) WITHOUT ROWID
+            ''')
+            if not exists:
+                # Migrazione: una coppia per ogni riga, duplicati compresi
+                self._backfill_query_results()
+    
+    def _backfill_query_results(self):
+        """Coppie query -> gruppo dalle righe di searched_groups; va eseguito prima di ``compact``"""
+        self.conn.execute('''
+            INSERT INTO query_results (search_query, group_key, seen)
+            SELECT search_query, group_key, COALESCE(last_seen, found_date) FROM searched_groups
+            WHERE group_key IS NOT NULL AND search_query IS NOT NULL AND search_query != ''
+            ON CONFLICT(search_query, group_key) DO UPDATE SET seen = MAX(seen, excluded.seen)
         ''')
+    
+    def intern_string(self, value):
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO callback_strings (value) VALUES (?)', (value,))
+            return self.conn.execute(
+                'SELECT id FROM callback_strings WHERE value = ?', (value,)).fetchone()[0]
+    
+    def lookup_string(self, value_id):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT value FROM callback_strings WHERE id = ?', (value_id,)).fetchone()
+            return row[0] if row else None
+    
+    def add_favorite(self, user_id, kind, value):
+        """Salva un preferito ('search' o 'group'); False se era gia' presente"""
+        with self._lock, self.conn:
+            return self.conn.execute('''
+                INSERT OR IGNORE INTO favorites (user_id, kind, value, saved_date)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, kind, value, datetime.now())).rowcount > 0
+    
+    def get_favorites(self, user_id, limit=50):
+        with self._lock:
+            return self.conn.execute('''
+                SELECT kind, value FROM favorites
+                WHERE user_id = ?
+                ORDER BY saved_date DESC
+                LIMIT ?
+            ''', (user_id, limit)).fetchall()
+    
+    def _create_indexes(self):
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_searched_groups_query
+                ON searched_groups(search_query, last_seen)
+            ''')
+            # Ranking per numero membri e filtri min/max di /cerca
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_searched_groups_rank
+                ON searched_groups(members_count, found_date)
+            ''')
+            # Paginazione keyset di /cerca su (members_count, id)
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_searched_groups_page
+                ON searched_groups(members_count, id)
+            ''')
+            # Aggregazioni incrementali di trending e categorie
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_searched_groups_seen
+                ON searched_groups(last_seen)
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_search_history_date
+                ON search_history(search_date)
+            ''')
+    
+    def _init_aggregates(self):
+        """Tabelle materializzate per /trending e le categorie"""
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS aggregate_state (
+                    name TEXT PRIMARY KEY,
+                    watermark TEXT
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_stats (
+                    search_query TEXT PRIMARY KEY,
+                    searches INTEGER,
+                    last_search DATETIME
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS group_categories (
+                    category TEXT,
+                    group_key TEXT,
+                    members_count INTEGER,
+                    PRIMARY KEY (category, group_key)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_group_categories_rank
+                ON group_categories(category, members_count)
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS trending_groups (
+                    rank INTEGER PRIMARY KEY,
+                    group_name TEXT,
+                    group_username TEXT,
+                    members_count INTEGER,
+                    category TEXT,
+                    searches INTEGER,
+                    invite_link TEXT
+                )
+            ''')
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(trending_groups)')}
+            if 'invite_link' not in columns:
+                self.conn.execute('ALTER TABLE trending_groups ADD COLUMN invite_link TEXT')
+            # Ricerche per query e giorno: il trending somma solo la finestra recente
+            daily_exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'query_stats_daily'"
+            ).fetchone()
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_stats_daily (
+                    search_query TEXT,
+                    day DATE,
+                    searches INTEGER,
+                    PRIMARY KEY (search_query, day)
+                ) WITHOUT ROWID
+            ''')
+            if not daily_exists:
+                # Migrazione: ricostruisce i conteggi giornalieri gia' aggregati in query_stats
+                self.conn.execute('''
+                    INSERT INTO query_stats_daily (search_query, day, searches)
+                    SELECT lower(trim(search_query)), date(search_date), COUNT(*)
+                    FROM search_history
+                    WHERE search_date <= COALESCE(
+                        (SELECT watermark FROM aggregate_state WHERE name = 'search_history'), '')
+                    GROUP BY lower(trim(search_query)), date(search_date)
+                ''')
+    
+    def _get_watermark(self, name):
+        row = self.conn.execute(
+            'SELECT watermark FROM aggregate_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else ''
+    
+    def _set_watermark(self, name, value):
+        self.conn.execute('''
+            INSERT INTO aggregate_state (name, watermark) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET watermark = excluded.watermark
+        ''', (name, str(value)))
+    
+    def refresh_aggregates(self, until, view_size=VIEW_SIZE):
+        """Aggiorna in modo incrementale le tabelle aggregate con le righe fino a ``until``"""
+        with self._lock, self.conn:
+            since = self._get_watermark('search_history')
+            self.conn.execute('''
+                INSERT INTO query_stats (search_query, searches, last_search)
+                SELECT lower(trim(search_query)), COUNT(*), MAX(search_date)
+                FROM search_history
+                WHERE search_date > ? AND search_date <= ?
+                GROUP BY lower(trim(search_query))
+                ON CONFLICT(search_query) DO UPDATE SET
+                    searches = searches + excluded.searches,
+                    last_search = MAX(last_search, excluded.last_search)
+            ''', (since, until))
+            self.conn.execute('''
+                INSERT INTO query_stats_daily (search_query, day, searches)
+                SELECT lower(trim(search_query)), date(search_date), COUNT(*)
+                FROM search_history
+                WHERE search_date > ? AND search_date <= ?
+                GROUP BY lower(trim(search_query)), date(search_date)
+                ON CONFLICT(search_query, day) DO UPDATE SET
+                    searches = searches + excluded.searches
+            ''', (since, until))
+            self._set_watermark('search_history', until)
+            
+            since = self._get_watermark('searched_groups')
+            rows = self.conn.execute('''
+                SELECT group_key, group_name, group_description, search_query, members_count
+                FROM searched_groups
+                WHERE group_key IS NOT NULL AND last_seen > ? AND last_seen <= ?
+            ''', (since, until)).fetchall()
+            self.conn.executemany('''
+                INSERT INTO group_categories (category, group_key, members_count) VALUES (?, ?, ?)
+                ON CONFLICT(category, group_key) DO UPDATE SET members_count = excluded.members_count
+            ''', [
+                (category, key, members)
+                for key, name, description, query, members in rows
+                for category in classify_group(name, description, query)
+            ])
+            self._set_watermark('searched_groups', until)
+            
+            # Trending: i gruppi delle query piu' cercate negli ultimi TRENDING_WINDOW_DAYS giorni
+            window_start = (until - timedelta(days=TRENDING_WINDOW_DAYS)).date()
+            self.conn.execute('DELETE FROM query_stats_daily WHERE day < ?', (window_start,))
+            self.conn.execute('DELETE FROM trending_groups')
+            trending = self.conn.execute('''
+                SELECT g.group_name, g.group_username, g.group_description, g.members_count,
+                       g.invite_link, q.search_query, MAX(q.searches) AS searches
+                FROM (SELECT search_query, SUM(searches) AS searches FROM query_stats_daily
+                      WHERE day >= ?
+                      GROUP BY search_query
+                      ORDER BY searches DESC LIMIT ?) q
+                JOIN query_results r ON r.search_query = q.search_query
+                JOIN searched_groups g ON g.group_key = r.group_key
+                GROUP BY g.group_key
+                ORDER BY searches DESC, g.members_count DESC
+                LIMIT ?
+            ''', (window_start, view_size, view_size)).fetchall()
+            self.conn.executemany('''
+                INSERT INTO trending_groups
+                (rank, group_name, group_username, members_count, category, searches, invite_link)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (rank, name, username, members,
+                 (classify_group(name, description, query) or [None])[0], searches, link)
+                for rank, (name, username, description, members, link, query, searches)
+                in enumerate(trending, 1)
+            ])
+    
+    def get_inline_entries(self, limit=INLINE_INDEX_SIZE):
+        """Gruppi piu' popolari con il numero di ricerche della query che li ha trovati"""
+        with self._lock:
+            return self.conn.execute('''
+                SELECT g.group_key, g.group_name, g.group_username, g.members_count,
+                       g.invite_link, COALESCE(q.searches, 0)
+                FROM searched_groups g
+                LEFT JOIN query_stats q ON q.search_query = g.search_query
+                WHERE g.group_key IS NOT NULL
+                ORDER BY g.members_count DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
+    
+    def load_views(self, view_size=VIEW_SIZE):
+        """Legge le viste materializzate: (trending, {categoria: gruppi})"""
+        with self._lock:
+            trending = [
+                {
+                    'title': name,
+                    'username': username,
+                    'members': members,
+                    'link': link or '',
+                    'category': CATEGORIES[category][0] if category in CATEGORIES else "🔎 Altro"
+                }
+                for name, username, members, category, link in self.conn.execute('''
+                    SELECT group_name, group_username, members_count, category, invite_link
+                    FROM trending_groups ORDER BY rank
+                ''')
+            ]
+            categories = {}
+            for category, name, username, members, link in self.conn.execute('''
+                SELECT c.category, g.group_name, g.group_username, g.members_count, g.invite_link
+                FROM (SELECT category, group_key, members_count,
+                             ROW_NUMBER() OVER (PARTITION BY category ORDER BY members_count DESC) AS position
+                      FROM group_categories) c
+                JOIN searched_groups g ON g.group_key = c.group_key
+                WHERE c.position <= ?
+                ORDER BY c.category, c.position
+            ''', (view_size,)):
+                categories.setdefault(category, []).append({
+                    'title': name,
+                    'username': username,
+                    'members': members,
+                    'link': link
+                })
+            return trending, categories
+    
+    def _migrate_members(self):
+        """Converte in intero i members_count salvati come testo ("5.2K")"""
+        with self._lock, self.conn:
+            rows = self.conn.execute('''
+                SELECT id, members_count FROM searched_groups
+                WHERE typeof(members_count) NOT IN ('integer', 'null')
+            ''').fetchall()
+            self.conn.executemany(
+                'UPDATE searched_groups SET members_count = ? WHERE id = ?',
+                [(parse_members(members), row_id) for row_id, members in rows]
+            )
+    
+    def _migrate_group_key(self):
+        """Aggiunge e popola group_key/last_seen sui database creati prima della chiave"""
+        with self._lock, self.conn:
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(searched_groups)')}
+            if 'group_key' not in columns:
+                self.conn.execute('ALTER TABLE searched_groups ADD COLUMN group_key TEXT')
+            if 'last_seen' not in columns:
+                self.conn.execute('ALTER TABLE searched_groups ADD COLUMN last_seen DATETIME')
+            self.conn.execute(
+                'UPDATE searched_groups SET last_seen = found_date WHERE last_seen IS NULL')
+            rows = self.conn.execute('''
+                SELECT id, group_username, invite_link, group_name
+                FROM searched_groups WHERE group_key IS NULL
+            ''').fetchall()
+            self.conn.executemany(
+                'UPDATE searched_groups SET group_key = ? WHERE id = ?',
+                [(normalize_group_key(username, link, name), row_id)
+                 for row_id, username, link, name in rows]
+            )
+    
+    def _ensure_unique_key(self):
+        with self._lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_searched_groups_key'"
+            ).fetchone()
+        if not exists:
+            self.compact(vacuum=False)
+    
+    def compact(self, vacuum=True):
+        """Elimina i duplicati per group_key (tiene la riga piu' recente) e crea il vincolo UNIQUE"""
+        with self._lock:
+            with self.conn:
+                # Senza un indice su group_key le sottoquery correlate sarebbero quadratiche
+                has_key_index = self.conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_searched_groups_key'"
+                ).fetchone()
+                if not has_key_index:
+                    self.conn.execute('CREATE INDEX IF NOT EXISTS idx_compact_key ON searched_groups(group_key)')
+                self.conn.execute('''
+                    UPDATE searched_groups SET
+                        members_count = (SELECT MAX(members_count) FROM searched_groups d
+                                         WHERE d.group_key = searched_groups.group_key),
+                        found_date = (SELECT MIN(found_date) FROM searched_groups d
+                                      WHERE d.group_key = searched_groups.group_key),
+                        last_seen = (SELECT MAX(COALESCE(last_seen, found_date)) FROM searched_groups d
+                                     WHERE d.group_key = searched_groups.group_key)
+                    WHERE id IN (SELECT MAX(id) FROM searched_groups
+                                 WHERE group_key IS NOT NULL GROUP BY group_key HAVING COUNT(*) > 1)
+                ''')
+                removed = self.conn.execute('''
+                    DELETE FROM searched_groups
+                    WHERE group_key IS NOT NULL
+                      AND id NOT IN (SELECT MAX(id) FROM searched_groups
+                                     WHERE group_key IS NOT NULL GROUP BY group_key)
+                ''').rowcount
+                self.conn.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_searched_groups_key
+                    ON searched_groups(group_key)
+                ''')
+                self.conn.execute('DROP INDEX IF EXISTS idx_compact_key')
+            if vacuum:
+                self.conn.execute('VACUUM')
+        if removed:
+            logger.info(f"Compattazione searched_groups: rimossi {removed} duplicati")
+        return removed
+    
+    def _init_fts(self, rebuild=False):
+        """Crea l'indice FTS5 su searched_groups e lo popola sui database esistenti"""
+        with self._lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'groups_fts'"
+            ).fetchone()
+            try:
+                with self.conn:
+                    self.conn.execute('''
+                        CREATE VIRTUAL TABLE IF NOT EXISTS groups_fts USING fts5(
+                            group_name, group_description, search_query,
+                            content='searched_groups', content_rowid='id',
+                            tokenize='unicode61 remove_diacritics 2'
+                        )
+                    ''')
+                    self.conn.execute('''
+                        CREATE TRIGGER IF NOT EXISTS searched_groups_fts_ai
+                        AFTER INSERT ON searched_groups BEGIN
+                            INSERT INTO groups_fts(rowid, group_name, group_description, search_query)
+                            VALUES (new.id, new.group_name, new.group_description, new.search_query);
+                        END
+                    ''')
+                    self.conn.execute('''
+                        CREATE TRIGGER IF NOT EXISTS searched_groups_fts_ad
+                        AFTER DELETE ON searched_groups BEGIN
+                            INSERT INTO groups_fts(groups_fts, rowid, group_name, group_description, search_query)
+                            VALUES ('delete', old.id, old.group_name, old.group_description, old.search_query);
+                        END
+                    ''')
+                    self.conn.execute('''
+                        CREATE TRIGGER IF NOT EXISTS searched_groups_fts_au
+                        AFTER UPDATE ON searched_groups BEGIN
+                            INSERT INTO groups_fts(groups_fts, rowid, group_name, group_description, search_query)
+                            VALUES ('delete', old.id, old.group_name, old.group_description, old.search_query);
+                            INSERT INTO groups_fts(rowid, group_name, group_description, search_query)
+                            VALUES (new.id, new.group_name, new.group_description, new.search_query);
+                        END
+                    ''')
+                    if rebuild or not exists:
+                        # Migrazione (o import massivo): indicizza le righe gia' presenti
+                        self.conn.execute("INSERT INTO groups_fts(groups_fts) VALUES ('rebuild')")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"FTS5 non disponibile, uso LIKE: {e}")
+                return False
+            return True
+    
+    def write_batch(self, groups, searches):
+        """Scrive gruppi e ricerche accumulati in un'unica transazione"""
+        with self._lock, self.conn:
+            if groups:
+                self.conn.executemany(self.INSERT_GROUP_SQL, groups)
+                self.conn.executemany(self.INSERT_QUERY_RESULT_SQL, [
+                    (row[7], row[0], row[8]) for row in groups if row[0]
+                ])
+            if searches:
+                self.conn.executemany(self.INSERT_SEARCH_SQL, searches)
+    
+    def bulk_import(self, rows, chunk_size=50000, progress=None):
+        """Carica in streaming righe (nell'ordine di CATALOG_COLUMNS) in searched_groups.
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS search_history (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER,
-                search_query TEXT,
-                results_count INTEGER,
-                search_date DATETIME
+        Durante il caricamento trigger FTS, indici e vincolo UNIQUE vengono
+        rimossi e le righe inserite con INSERT semplici, una transazione ogni
+        ``chunk_size``; alla fine i duplicati vengono fusi da ``compact`` e
+        indici e FTS ricostruiti una sola volta. Il bot non deve essere in
+        esecuzione sullo stesso database durante l'import.
+        """
+        insert_sql = (
+            f"INSERT INTO searched_groups ({', '.join(self.CATALOG_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(self.CATALOG_COLUMNS))})"
+        )
+        rows = iter(rows)
+        imported = 0
+        with self._lock:
+            with self.conn:
+                for trigger in self.FTS_TRIGGERS:
+                    self.conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                for index in self.GROUP_INDEXES:
+                    self.conn.execute(f'DROP INDEX IF EXISTS {index}')
+            try:
+                while True:
+                    chunk = list(itertools.islice(rows, chunk_size))
+                    if not chunk:
+                        break
+                    with self.conn:
+                        self.conn.executemany(insert_sql, chunk)
+                    imported += len(chunk)
+                    if progress:
+                        progress(imported)
+            finally:
+                # Anche se l'import si interrompe il database torna coerente;
+                # le coppie query -> gruppo vanno lette prima che compact fonda i duplicati
+                with self.conn:
+                    self._backfill_query_results()
+                removed = self.compact(vacuum=False)
+                if self.fts_enabled:
+                    self._init_fts(rebuild=True)
+                self._create_indexes()
+                with self.conn:
+                    # Le categorie vengono ricalcolate su tutto il catalogo alla prossima aggregazione
+                    self.conn.execute("DELETE FROM aggregate_state WHERE name = 'searched_groups'")
+                self.conn.execute('ANALYZE')
+        return imported, removed
+    
+    def iter_catalog(self, chunk_size=10000):
+        """Tutte le righe di searched_groups (colonne CATALOG_COLUMNS), lette a blocchi per id"""
+        sql = f'''
+            SELECT id, {', '.join(self.CATALOG_COLUMNS)} FROM searched_groups
+            WHERE id > ? ORDER BY id LIMIT ?
+        '''
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(sql, (last_id, chunk_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+    
+    def snapshot(self, path):
+        """Copia coerente del database (backup API di SQLite), anche con il bot in esecuzione"""
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                self.conn.backup(target, pages=4096)
+        finally:
+            target.close()
+    
+    def get_recent_groups(self, search_query, max_age, limit=20):
+        """Gruppi trovati per la stessa query (normalizzata) negli ultimi max_age secondi"""
+        since = datetime.now() - timedelta(seconds=max_age)
+        with self._lock:
+            return self.conn.execute('''
+                SELECT g.group_name, g.group_username, g.group_description, g.members_count, g.invite_link
+                FROM query_results r
+                JOIN searched_groups g ON g.group_key = r.group_key
+                WHERE r.search_query = ? AND r.seen >= ?
+                ORDER BY g.members_count DESC
+                LIMIT ?
+            ''', (search_query, since, limit)).fetchall()
+    
+    @staticmethod
+    def _members_filter(min_members, max_members, column='members_count'):
+        """Clausola SQL (e parametri) per i filtri min/max sui membri"""
+        if min_members is None and max_members is None:
+            return '', ()
+        return (f'AND {column} BETWEEN ? AND ?',
+                (min_members or 0, max_members if max_members is not None else 2 ** 63 - 1))
+    
+    def _members_index_first(self, match, min_members=None, max_members=None):
+        """Piano delle query FTS ordinate per numero di membri.
+        
+        True: scorre l'indice per membri fino al LIMIT verificando ogni riga
+        sull'insieme delle corrispondenze FTS (conviene con molte corrispondenze
+        o con un filtro min/max selettivo); False: legge le righe di tutte le
+        corrispondenze FTS e le ordina (conviene quando sono poche).
+        """
+        matches = self.conn.execute(
+            'SELECT COUNT(*) FROM (SELECT 1 FROM groups_fts WHERE groups_fts MATCH ? LIMIT ?)',
+            (match, self.FTS_SCAN_LIMIT)).fetchone()[0]
+        if matches >= self.FTS_SCAN_LIMIT:
+            return True
+        members_filter, members_params = self._members_filter(min_members, max_members)
+        if not members_filter:
+            return False
+        budget = matches
+        in_range = self.conn.execute(f'''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM searched_groups WHERE members_count IS NOT NULL {members_filter} LIMIT ?
             )
-        ''')
+        ''', (*members_params, budget + 1)).fetchone()[0]
+        return in_range <= budget
+    
+    def _text_filter(self, search_query, match, min_members=None, max_members=None):
+        """Predicato testuale (e parametri) su searched_groups g per le query ordinate per membri"""
+        if not match:
+            pattern = f"%{search_query}%"
+            return ('(g.search_query LIKE ? OR g.group_name LIKE ? OR g.group_description LIKE ?)',
+                    (pattern, pattern, pattern))
+        if self._members_index_first(match, min_members, max_members):
+            # Il + su g.id impedisce a SQLite di partire dalle corrispondenze FTS
+            return '+g.id IN (SELECT rowid FROM groups_fts WHERE groups_fts MATCH ?)', (match,)
+        return 'g.id IN (SELECT rowid FROM groups_fts WHERE groups_fts MATCH ?)', (match,)
+    
+    def get_saved_groups(self, search_query, limit=20, min_members=None, max_members=None):
+        """Gruppi salvati per la query.
         
-        conn.commit()
-        conn.close()
-    
-    def save_group(self, group_name, group_username, group_description, members_count, 
-                   group_type, invite_link, search_query):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO searched_groups 
-            (group_name, group_username, group_description, members_count, 
-             group_type, invite_link, search_query, found_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (group_name, group_username, group_description, members_count,
-              group_type, invite_link, search_query, datetime.now()))
-        conn.commit()
-        conn.close()
-    
-    def save_search(self, user_id, search_query, results_count):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO search_history 
-            (user_id, search_query, results_count, search_date)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, search_query, results_count, datetime.now()))
-        conn.commit()
-        conn.close()
-    
-    def get_saved_groups(self, search_query, limit=20):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT group_name, group_username, group_description, members_count, 
-                   group_type, invite_link
-            FROM searched_groups 
-            WHERE search_query LIKE ? OR group_name LIKE ? OR group_description LIKE ?
-            ORDER BY members_count DESC, found_date DESC
-            LIMIT ?
-        ''', (f"%{search_query}%", f"%{search_query}%", f"%{search_query}%", limit))
-        
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        Con FTS e senza filtri l'ordine e' bm25 pesato per i membri; altrimenti
+        per membri decrescenti, con i filtri min/max risolti su
+        idx_searched_groups_rank (vedi ``_members_index_first``).
+        """
+        match = fts_match_expression(search_query) if self.fts_enabled else ''
+        with self._lock:
+            if match and min_members is None and max_members is None:
+                cursor = self.conn.execute('''
+                    SELECT g.group_name, g.group_username, g.group_description, g.members_count, 
+                           g.group_type, g.invite_link
+                    FROM groups_fts
+                    JOIN searched_groups g ON g.id = groups_fts.rowid
+                    WHERE groups_fts MATCH ?
+                    ORDER BY bm25(groups_fts, 10.0, 2.0, 5.0) - ? * members_log(g.members_count)
+                    LIMIT ?
+                ''', (match, FTS_MEMBERS_WEIGHT, limit))
+            else:
+                text_filter, text_params = self._text_filter(search_query, match, min_members, max_members)
+                members_filter, members_params = self._members_filter(
+                    min_members, max_members, 'g.members_count')
+                cursor = self.conn.execute(f'''
+                    SELECT g.group_name, g.group_username, g.group_description, g.members_count, 
+                           g.group_type, g.invite_link
+                    FROM searched_groups g
+                    WHERE {text_filter} {members_filter}
+                    ORDER BY g.members_count DESC, g.found_date DESC
+                    LIMIT ?
+                ''', (*text_params, *members_params, limit))
+            return cursor.fetchall()
+    
+    def get_groups_page(self, search_query, after=None, limit=RESULTS_PER_PAGE,
+                        min_members=None, max_members=None):
+        """Paginazione keyset per numero di membri decrescente.
+        
+        ``after`` e' la coppia (members_count, id) dell'ultima riga gia' mostrata;
+        restituisce righe (id, nome, username, descrizione, membri, link). Ordine e
+        predicato keyset sono sulle colonne nude, servite da idx_searched_groups_page;
+        i gruppi senza numero di membri seguono tutti gli altri, per id decrescente
+        (``after`` con members_count None).
+        """
+        match = fts_match_expression(search_query) if self.fts_enabled else ''
+        rows = []
+        with self._lock:
+            text_filter, text_params = self._text_filter(search_query, match, min_members, max_members)
+            if after is None or after[0] is not None:
+                members, last_id = after or (2 ** 63 - 1, 2 ** 63 - 1)
+                members_filter, members_params = self._members_filter(
+                    min_members, max_members, 'g.members_count')
+                rows = self.conn.execute(f'''
+                    SELECT g.id, g.group_name, g.group_username, g.group_description,
+                           g.members_count, g.invite_link
+                    FROM searched_groups g
+                    WHERE {text_filter} {members_filter}
+                      AND g.members_count IS NOT NULL AND (g.members_count, g.id) < (?, ?)
+                    ORDER BY g.members_count DESC, g.id DESC
+                    LIMIT ?
+                ''', (*text_params, *members_params, members, last_id, limit)).fetchall()
+                after = (None, 2 ** 63 - 1)
+            # I filtri min/max escludono comunque i gruppi senza numero di membri
+            if len(rows) < limit and min_members is None and max_members is None:
+                rows += self.conn.execute(f'''
+                    SELECT g.id, g.group_name, g.group_username, g.group_description,
+                           g.members_count, g.invite_link
+                    FROM searched_groups g
+                    WHERE {text_filter} AND g.members_count IS NULL AND g.id < ?
+                    ORDER BY g.id DESC
+                    LIMIT ?
+                ''', (*text_params, after[1], limit - len(rows))).fetchall()
+        return rows
 
 # Inizializza database
 db = GroupSearchDB()
 
-class TelegramGroupSearcher:
+class WriteBehindQueue:
+    """Coda di scritture differite condivisa da tutti gli utenti.
+    
+    Le righe vengono accumulate in memoria e scritte con ``executemany`` in
+    un'unica transazione al raggiungimento di una soglia di dimensione o tempo.
+    Un batch fallito viene ritentato dal timer fino a ``max_retries`` volte,
+    poi riga per riga scartando quelle che continuano a fallire; oltre
+    ``max_pending`` righe in attesa le nuove vengono scartate.
+    """
+    def __init__(self, database, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL,
+                 max_pending=WRITE_MAX_PENDING, max_retries=WRITE_MAX_RETRIES):
+        self.db = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.groups = []
+        self.searches = []
+        self.flushes = 0
+        self.rows_written = 0
+        self.dropped = 0
+        self.failures = 0
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+        self._flush_task = None
+    
+    def pending(self):
+        return len(self.groups) + len(self.searches)
+    
+    def _accept(self):
+        if self.pending() < self.max_pending:
+            return True
+        self.dropped += 1
+        metrics.inc('bot_errors_total', where='db_write_dropped')
+        if self.dropped % 1000 == 1:
+            logger.warning(f"Coda di scrittura piena ({self.max_pending} righe): {self.dropped} righe scartate")
+        return False
+    
+    def add_group(self, group_name, group_username, group_description, members_count,
+                  group_type, invite_link, search_query):
+        if not self._accept():
+            return
+        self.groups.append((normalize_group_key(group_username, invite_link, group_name),
+                            group_name, group_username, group_description, parse_members(members_count),
+                            group_type, invite_link, search_query, datetime.now()))
+        self._schedule()
+    
+    def add_search(self, user_id, search_query, results_count):
+        if not self._accept():
+            return
+        self.searches.append((user_id, search_query, results_count, datetime.now()))
+        self._schedule()
+    
+    def _schedule(self):
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._periodic_flush())
+        # Un solo flush per soglia alla volta; dopo un errore ritenta solo il timer
+        if (self.pending() >= self.batch_size and not self.failures
+                and (self._flush_task is None or self._flush_task.done())):
+            self._flush_task = asyncio.create_task(self.flush())
+    
+    async def _periodic_flush(self):
+        # Il timer sopravvive alla richiesta che l'ha avviato: non ereditarne la traccia
+        _current_span.set(None)
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self.pending():
+                # Nessuna scrittura in attesa: il timer ripartira' alla prossima riga
+                return
+    
+    async def flush(self):
+        async with self._flush_lock:
+            groups, self.groups = self.groups, []
+            searches, self.searches = self.searches, []
+            if not groups and not searches:
+                return
+            try:
+                await self.db.run(self.db.write_batch, groups, searches)
+            except Exception as e:
+                self.failures += 1
+                metrics.inc('bot_errors_total', where='db_write')
+                logger.error(f"Errore scrittura batch (tentativo {self.failures}): {e}")
+                if self.failures < self.max_retries:
+                    # Rimetti in coda le righe per il prossimo tentativo
+                    self.groups[:0] = groups
+                    self.searches[:0] = searches
+                    return
+                written = await self._write_rows(groups, searches)
+            else:
+                written = len(groups) + len(searches)
+            self.failures = 0
+            self.flushes += 1
+            self.rows_written += written
+    
+    async def _write_rows(self, groups, searches):
+        """Ultimo tentativo riga per riga: le righe che falliscono ancora vengono scartate"""
+        written = 0
+        rows = [([row], []) for row in groups] + [([], [row]) for row in searches]
+        for batch_groups, batch_searches in rows:
+            try:
+                await self.db.run(self.db.write_batch, batch_groups, batch_searches)
+                written += 1
+            except Exception as e:
+                self.dropped += 1
+                metrics.inc('bot_errors_total', where='db_write_dropped')
+                logger.error(f"Riga scartata dopo {self.failures} tentativi: {(batch_groups or batch_searches)[0]} ({e})")
+        return written
+    
+    async def close(self):
+        """Svuota la coda prima dello spegnimento"""
+        if self._timer and not self._timer.done():
+            self._timer.cancel()
+        if self._flush_task and not self._flush_task.done():
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        # Ritenta fino a esaurire i tentativi: le righe difettose vengono scartate, non perse in silenzio
+        for _ in range(self.max_retries + 1):
+            await self.flush()
+            if not self.pending():
+                break
+
+write_queue = WriteBehindQueue(db)
+
+class LatencyStats:
+    """Statistiche di latenza (finestra mobile), errori e timeout"""
+    def __init__(self, window=500):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=window)
+    
+    def record(self, latency):
+        self.calls += 1
+        self.latencies.append(latency)
+    
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+    
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'p50_ms': round(self.percentile(50) * 1000, 1),
+            'p99_ms': round(self.percentile(99) * 1000, 1),
+        }
+
+class TelegramCardParser(HTMLParser):
+    """Parser incrementale delle schede canale/gruppo delle pagine t.me.
+    
+    Riconosce sia l'intestazione delle anteprime ``t.me/s/<nome>``
+    (``tgme_channel_info``) sia la pagina ``t.me/<nome>`` (``tgme_page``).
+    Va alimentato a chunk con ``feed``. Ogni pagina contiene al piu' una
+    scheda, seguita dai post del canale: ``done`` diventa vero appena la
+    scheda si chiude (o dopo ``limit`` schede), cosi' il chiamante puo'
+    smettere di leggere senza scaricare e analizzare i post.
+    """
+    CARD_CLASSES = {'tgme_channel_info', 'tgme_page'}
+    FIELD_CLASSES = {
+        'tgme_channel_info_header_title': 'title',
+        'tgme_page_title': 'title',
+        'tgme_channel_info_header_username': 'username',
+        'tgme_channel_info_description': 'description',
+        'tgme_page_description': 'description',
+        'tgme_page_extra': 'extra',
+        'counter_value': 'counter_value',
+        'counter_type': 'counter_type',
+    }
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                 'link', 'meta', 'source', 'track', 'wbr'}
+    MEMBER_WORDS = ('subscriber', 'member', 'iscritt', 'membri')
+    
+    def __init__(self, limit=5):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.results = []
+        self.depth = 0
+        self.card = None
+        self.card_depth = None
+        self.field = None
+        self.field_depth = None
+        self.buffer = []
+        self.card_closed = False
+    
+    @property
+    def done(self):
+        return self.card_closed or len(self.results) >= self.limit
+    
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        void = tag in self.VOID_TAGS
+        if not void:
+            self.depth += 1
+        classes = set()
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes.update(value.split())
+        
+        if self.card is None:
+            if classes & self.CARD_CLASSES and not void:
+                self.card = {}
+                self.card_depth = self.depth
+            return
+        if self.field is None and not void:
+            for css_class in classes:
+                if css_class in self.FIELD_CLASSES:
+                    self.field = self.FIELD_CLASSES[css_class]
+                    self.field_depth = self.depth
+                    self.buffer = []
+                    break
+        if tag == 'br' and self.field == 'description':
+            self.buffer.append('\n')
+    
+    def handle_endtag(self, tag):
+        if self.done or tag in self.VOID_TAGS:
+            return
+        if self.field is not None and self.depth == self.field_depth:
+            self._finish_field()
+        if self.card is not None and self.depth == self.card_depth:
+            self._finish_card()
+        self.depth = max(0, self.depth - 1)
+    
+    def handle_data(self, data):
+        if self.field is not None:
+            self.buffer.append(data)
+    
+    def _finish_field(self):
+        text = ' '.join(''.join(self.buffer).split())
+        field, self.field, self.field_depth = self.field, None, None
+        if field == 'counter_value':
+            self.card['_counter'] = text
+        elif field == 'counter_type':
+            if text.lower().startswith(self.MEMBER_WORDS) and '_counter' in self.card:
+                self.card.setdefault('members', self.card['_counter'])
+        elif field == 'extra':
+            # Es. "12 345 subscribers" oppure "1 234 members, 56 online"
+            match = re.match(r'([\d\s.,]+[KkMm]?)\s+(\w+)', text)
+            if match and match.group(2).lower().startswith(self.MEMBER_WORDS):
+                self.card.setdefault('members', re.sub(r'\s', '', match.group(1)))
+        elif text and field not in self.card:
+            self.card[field] = text
+    
+    def _finish_card(self):
+        card, self.card, self.card_depth = self.card, None, None
+        self.card_closed = True
+        if not card.get('title'):
+            return
+        username = card.get('username', '').lstrip('@')
+        self.results.append({
+            'title': card['title'],
+            'username': username,
+            'description': card.get('description', ''),
+            'members': card.get('members', 'N/A'),
+            'link': f"https://t.me/{username}" if username else ''
+        })
+
+class TokenBucket:
+    """Token bucket non bloccante con rate adattivo.
+    
+    Ad ogni 429 il rate si dimezza (fino a min_rate), ad ogni successo
+    risale gradualmente verso il rate configurato.
+    """
+    def __init__(self, rate=SOURCE_RATE, capacity=SOURCE_BURST, min_rate=0.1):
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.rejected = 0
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_acquire(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.rejected += 1
+        return False
+    
+    async def acquire(self):
+        """Attende il proprio turno: i token vengono prenotati in ordine di arrivo"""
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+    
+    def on_success(self):
+        self.rate = min(self.base_rate, self.rate + self.base_rate * 0.1)
+    
+    def on_throttled(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+
+class CircuitBreaker:
+    """Circuit breaker: si apre dopo ``failure_threshold`` errori consecutivi e
+    dopo ``reset_timeout`` secondi lascia passare una sola richiesta di prova"""
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.probe_inflight = False
+        self.rejected = 0
+    
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() >= self.open_until:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self.probe_inflight:
+            self.probe_inflight = True
+            return True
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_inflight = False
+    
+    def record_failure(self, retry_after=None):
+        self.failures += 1
+        self.probe_inflight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold or retry_after:
+            self.state = self.OPEN
+            self.open_until = time.monotonic() + max(self.reset_timeout, retry_after or 0)
+    
+    def record_cancelled(self):
+        # Richiesta interrotta dalla deadline: non e' un errore della fonte
+        self.probe_inflight = False
+
+class SingleFlight:
+    """Deduplica chiamate concorrenti identiche: chi arriva mentre una chiamata
+    con la stessa chiave e' in corso ne attende il risultato invece di ripeterla"""
     def __init__(self):
+        self.inflight = {}
+        self.calls = 0
+        self.shared = 0
+    
+    async def do(self, key, func, *args):
+        task = self.inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args))
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        # shield: se un richiedente viene cancellato la chiamata condivisa prosegue
+        return await asyncio.shield(task)
+    
+    def _done(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+    
+    def stats(self):
+        return {'calls': self.calls, 'shared': self.shared, 'inflight': len(self.inflight)}
+
+class TelegramGroupSearcher:
+    def __init__(self, source_timeouts=None, deadline=SEARCH_DEADLINE):
         self.session = None
+        self.source_timeouts = dict(SOURCE_TIMEOUTS)
+        if source_timeouts:
+            self.source_timeouts.update(source_timeouts)
+        self.deadline = deadline
+        # Fonti interrogate in parallelo, nell'ordine in cui uniamo i risultati
+        self.sources = [
+            ('telegram_me', self.search_telegram_me),
+            ('tlgrm_eu', self.search_tlgrm_eu),
+            ('tgstat', self.search_tgstat),
+        ]
+        self.source_stats = {name: LatencyStats() for name, _ in self.sources}
+        self.limiters = {name: TokenBucket() for name, _ in self.sources}
+        self.breakers = {name: CircuitBreaker() for name, _ in self.sources}
+        self.info_flight = SingleFlight()
     
     async def create_session(self):
-        if not self.session:
-            self.session = aiohttp.ClientSession()
+        """Crea la sessione HTTP condivisa (chiamata da post_init, o pigramente al primo uso)"""
+        if self.session and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            use_dns_cache=True,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            enable_cleanup_closed=True
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TIMEOUT_TOTAL,
+            connect=HTTP_TIMEOUT_CONNECT,
+            sock_read=HTTP_TIMEOUT_READ
+        )
+        if HTTP_COMPRESSION:
+            accept_encoding = 'gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate'
+        else:
+            accept_encoding = 'identity'
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={'User-Agent': HTTP_USER_AGENT, 'Accept-Encoding': accept_encoding},
+            auto_decompress=HTTP_COMPRESSION
+        )
     
     async def close_session(self):
         if self.session:
             await self.session.close()
+            self.session = None
     
-    async def search_groups_web(self, query, limit=15):
-        """Cerca gruppi usando varie fonti web"""
-        results = []
+    def get_source_stats(self):
+        """Latenze, conteggi di timeout/errori e stato di limiter e breaker per ogni fonte"""
+        return {
+            name: {
+                **stats.as_dict(),
+                'breaker': self.breakers[name].state,
+                'skipped': self.breakers[name].rejected,
+                'throttled': self.limiters[name].rejected,
+                'rate': round(self.limiters[name].rate, 2),
+            }
+            for name, stats in self.source_stats.items()
+        }
+    
+    async def _run_source(self, name, search_func, query, limit):
+        """Esegue una fonte con il suo timeout, senza mai propagare errori.
         
-        # Cerca su diverse piattaforme
-        sources = [
-            await self.search_telegram_me(query, limit//3),
-            await self.search_tlgrm_eu(query, limit//3),
-            await self.search_tgstat(query, limit//3)
-        ]
+        Le fonti con circuit breaker aperto o senza token disponibili vengono
+        saltate subito, senza attendere alcun timeout.
+        """
+        breaker = self.breakers[name]
+        limiter = self.limiters[name]
+        # Prima il breaker: una fonte aperta non deve consumare token
+        if not breaker.allow():
+            return []
+        if not limiter.try_acquire():
+            # Libera l'eventuale richiesta di prova riservata dal breaker semiaperto
+            breaker.record_cancelled()
+            return []
         
-        for source_results in sources:
-            results.extend(source_results)
+        stats = self.source_stats[name]
+        start = time.perf_counter()
+        try:
+            with tracer.span(f"source.{name}"):
+                results = await asyncio.wait_for(
+                    search_func(query, limit),
+                    self.source_timeouts.get(name, SOURCE_TIMEOUT)
+                )
+            breaker.record_success()
+            limiter.on_success()
+            return results
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            breaker.record_failure()
+            logger.warning(f"Timeout fonte {name} per query '{query}'")
+        except asyncio.CancelledError:
+            # Cancellata perche' oltre la deadline complessiva
+            stats.timeouts += 1
+            breaker.record_cancelled()
+            raise
+        except aiohttp.ClientResponseError as e:
+            if 400 <= e.status < 500 and e.status != 429:
+                # Richiesta rifiutata (es. 404 per un nome inesistente): la fonte
+                # risponde, quindi nessun risultato ma nemmeno un guasto
+                breaker.record_success()
+                return []
+            stats.errors += 1
+            retry_after = None
+            if e.status == 429:
+                limiter.on_throttled()
+                value = (e.headers or {}).get('Retry-After', '')
+                retry_after = float(value) if value.isdigit() else None
+            breaker.record_failure(retry_after)
+            logger.error(f"Errore fonte {name}: HTTP {e.status}")
+        except Exception as e:
+            stats.errors += 1
+            breaker.record_failure()
+            logger.error(f"Errore fonte {name}: {e}")
+        finally:
+            latency = time.perf_counter() - start
+            stats.record(latency)
+            metrics.observe('bot_source_seconds', latency, source=name)
+        return []
+    
+    async def search_groups_web(self, query, limit=15, deadline=None):
+        """Cerca gruppi usando varie fonti web in parallelo"""
+        if deadline is None:
+            deadline = self.deadline
+        
+        per_source = max(1, limit // len(self.sources))
+        with tracer.span("search_groups_web", query=query) as span:
+            tasks = [
+                asyncio.create_task(self._run_source(name, func, query, per_source))
+                for name, func in self.sources
+            ]
+            
+            # Restituisci cio' che e' pronto entro la deadline, le fonti lente vengono scartate
+            done, pending = await asyncio.wait(tasks, timeout=deadline if deadline > 0 else None)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            if span is not None:
+                span['attrs']['late_sources'] = len(pending)
+        
+        results = []
+        for task in tasks:
+            if task in done:
+                results.extend(task.result())
         
         # Rimuovi duplicati
         seen = set()
         unique_results = []
         for result in results:
-            identifier = result.get('username', '') + result.get('title', '')
+            identifier = normalize_group_key(
+                result.get('username', ''), result.get('link', ''), result.get('title', ''))
             if identifier not in seen:
                 seen.add(identifier)
                 unique_results.append(result)
@@ -140,31 +1754,34 @@ class TelegramGroupSearcher:
         return unique_results[:limit]
     
     async def search_telegram_me(self, query, limit=5):
-        """Cerca su telegram.me"""
+        """Cerca su telegram.me (429 e 5xx vengono propagati al circuit breaker)"""
         await self.create_session()
         results = []
         
-        try:
-            search_url = f"https://telegram.me/s/{urllib.parse.quote(query)}"
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            
-            async with self.session.get(search_url, headers=headers) as response:
-                if response.status == 200:
-                    text = await response.text()
-                    # Parsing semplificato - nella realtà useresti BeautifulSoup
-                    # Qui simuliamo alcuni risultati per l'esempio
-                    results.append({
-                        'title': f"Gruppo {query.title()}",
-                        'username': f"{query.lower().replace(' ', '')}_group",
-                        'description': f"Gruppo dedicato a {query}",
-                        'members': "5.2K",
-                        'link': f"https://t.me/{query.lower().replace(' ', '')}_group"
-                    })
-        
-        except Exception as e:
-            logger.error(f"Errore ricerca telegram.me: {e}")
+        search_url = f"{TELEGRAM_ME_URL}/s/{urllib.parse.quote(query)}"
+        async with self.session.get(search_url) as response:
+            if 400 <= response.status < 500 and response.status != 429:
+                # Nome inesistente o non valido: nessun risultato, non un guasto della fonte
+                return results
+            response.raise_for_status()
+            if response.status == 200:
+                # Parsing a chunk: ci si ferma appena trovate `limit` schede
+                parser = TelegramCardParser(limit)
+                decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+                async for chunk in response.content.iter_chunked(PARSE_CHUNK_SIZE):
+                    parser.feed(decoder.decode(chunk))
+                    if parser.done:
+                        break
+                else:
+                    parser.feed(decoder.decode(b'', final=True))
+                    parser.close()
+                
+                for result in parser.results[:limit]:
+                    # L'anteprima /s/<nome> e' quella del canale cercato
+                    if not result['username'] and re.fullmatch(r'\w{5,32}', query):
+                        result['username'] = query
+                        result['link'] = f"https://t.me/{query}"
+                    results.append(result)
         
         return results
     
@@ -210,7 +1827,13 @@ class TelegramGroupSearcher:
         return mock_results[:limit]
     
     async def get_group_info(self, username_or_link):
-        """Ottieni informazioni dettagliate di un gruppo"""
+        """Ottieni informazioni dettagliate di un gruppo (richieste identiche concorrenti unificate)"""
+        key = normalize_group_key('', username_or_link) or normalize_group_key(username_or_link)
+        if not key:
+            return None
+        return await self.info_flight.do(key, self._fetch_group_info, username_or_link)
+    
+    async def _fetch_group_info(self, username_or_link):
         await self.create_session()
         
         try:
@@ -238,9 +1861,642 @@ class TelegramGroupSearcher:
 # Inizializza searcher
 searcher = TelegramGroupSearcher()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handler per il comando /start"""
-    welcome_text = """
+class LRUCache:
+    """Cache LRU limitata in dimensione, con eta' delle voci"""
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.evictions = 0
+    
+    def get(self, key):
+        """Restituisce (valore, eta' in secondi) oppure None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        value, stored_at = entry
+        return value, time.monotonic() - stored_at
+    
+    def set(self, key, value):
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+    
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+class PrefixIndex:
+    """Indice dei prefissi per l'autocompletamento inline.
+    
+    Per ogni prefisso (di ogni parola del nome, dello username e del nome
+    completo) mantiene gia' ordinati i ``top_k`` gruppi piu' popolari, cosi'
+    una ricerca costa un accesso a dizionario. Si aggiorna ad ogni gruppo salvato;
+    oltre ``max_items`` gruppi viene rimosso quello con il punteggio piu' basso
+    (min-heap con cancellazione pigra).
+    
+    Ogni gruppo occupa circa 100 prefissi: con INLINE_INDEX_SIZE=20000 l'indice
+    pesa nell'ordine di 100 MB di RSS, e la memoria cresce linearmente con il limite.
+    """
+    def __init__(self, top_k=INLINE_RESULTS, max_prefix=24, max_items=INLINE_INDEX_SIZE):
+        self.top_k = top_k
+        self.max_prefix = max_prefix
+        self.max_items = max_items
+        self.items = {}
+        # prefisso -> chiavi in ordine di punteggio decrescente
+        self.prefixes = {}
+        self.heap = []
+        self.evictions = 0
+    
+    @staticmethod
+    def score(members_count, searches=0):
+        return _members_log(parse_members(members_count)) + 2 * math.log1p(searches)
+    
+    def _prefixes(self, title, username):
+        name = ' '.join((title or '').lower().split())
+        terms = set(re.findall(r'\w+', name))
+        terms.add(name)
+        if username:
+            terms.add(username.lower())
+        return {term[:length] for term in terms for length in range(1, min(len(term), self.max_prefix) + 1)}
+    
+    def _lowest(self):
+        """(punteggio, chiave) del gruppo meno popolare, scartando le voci obsolete dello heap"""
+        while self.heap:
+            score, key = self.heap[0]
+            item = self.items.get(key)
+            if item is not None and item[0] == score:
+                return score, key
+            heapq.heappop(self.heap)
+        return None
+    
+    def _unlink(self, key, entry):
+        """Toglie la chiave dai bucket dei prefissi di ``entry``"""
+        for prefix in self._prefixes(entry['title'], entry['username']):
+            bucket = self.prefixes.get(prefix)
+            if bucket and key in bucket:
+                bucket.remove(key)
+                if not bucket:
+                    del self.prefixes[prefix]
+    
+    def _evict(self, key):
+        _, entry = self.items.pop(key)
+        self.evictions += 1
+        self._unlink(key, entry)
+    
+    def add(self, key, title, username, members_count, link, searches=0):
+        if not key:
+            return
+        score = self.score(members_count, searches)
+        previous = self.items.get(key)
+        if previous and previous[0] > score:
+            # Mantieni il punteggio piu' alto (es. ricerche gia' conteggiate)
+            score = previous[0]
+        self._put(key, score, {
+            'title': title,
+            'username': username,
+            'members': members_count,
+            'link': link
+        })
+    
+    def _put(self, key, score, entry):
+        previous = self.items.get(key)
+        if previous is None and len(self.items) >= self.max_items:
+            lowest = self._lowest()
+            if lowest is None or score <= lowest[0]:
+                return
+            self._evict(lowest[1])
+        if previous is not None:
+            self._unlink(key, previous[1])
+        self.items[key] = (score, entry)
+        heapq.heappush(self.heap, (score, key))
+        if len(self.heap) > 2 * self.max_items:
+            # Troppe voci obsolete: ricostruisci lo heap dai punteggi correnti
+            self.heap = [(item[0], item_key) for item_key, item in self.items.items()]
+            heapq.heapify(self.heap)
+        
+        for prefix in self._prefixes(entry['title'], entry['username']):
+            self._insert(prefix, key, score)
+    
+    def _insert(self, prefix, key, score):
+        bucket = self.prefixes.setdefault(prefix, [])
+        # Ricerca binaria della posizione (come bisect.insort, sui punteggi decrescenti)
+        low, high = 0, len(bucket)
+        while low < high:
+            middle = (low + high) // 2
+            if self.items[bucket[middle]][0] >= score:
+                low = middle + 1
+            else:
+                high = middle
+        if low >= self.top_k:
+            return
+        bucket.insert(low, key)
+        del bucket[self.top_k:]
+    
+    def build(self, entries):
+        """Nuovo indice con gli stessi parametri; non tocca questo, si puo' eseguire in un thread"""
+        fresh = PrefixIndex(self.top_k, self.max_prefix, self.max_items)
+        for key, title, username, members, link, searches in entries:
+            if not key:
+                continue
+            score = max(self.score(members, searches), fresh.items.get(key, (-math.inf,))[0])
+            fresh.items[key] = (score, {
+                'title': title,
+                'username': username,
+                'members': members,
+                'link': link
+            })
+        ranked = sorted(fresh.items.items(), key=lambda item: item[1][0], reverse=True)
+        for key, _ in ranked[self.max_items:]:
+            del fresh.items[key]
+        # In ordine di punteggio ogni bucket si riempie gia' ordinato: basta accodare
+        prefixes = fresh.prefixes
+        for key, (score, entry) in ranked[:self.max_items]:
+            for prefix in fresh._prefixes(entry['title'], entry['username']):
+                bucket = prefixes.get(prefix)
+                if bucket is None:
+                    prefixes[prefix] = [key]
+                elif len(bucket) < self.top_k:
+                    bucket.append(key)
+        fresh.heap = [(score, key) for key, (score, _) in fresh.items.items()]
+        heapq.heapify(fresh.heap)
+        return fresh
+    
+    def replace(self, fresh):
+        """Adotta l'indice costruito da ``build``, conservando i gruppi aggiunti nel frattempo"""
+        for key, (score, entry) in self.items.items():
+            current = fresh.items.get(key)
+            fresh._put(key, max(score, current[0]) if current else score, entry)
+        self.items, self.prefixes, self.heap = fresh.items, fresh.prefixes, fresh.heap
+        self.evictions += fresh.evictions
+    
+    async def load(self, database):
+        """Carica i gruppi piu' popolari dal database senza bloccare l'event loop"""
+        try:
+            entries = await database.run(database.get_inline_entries, self.max_items)
+            loop = asyncio.get_running_loop()
+            fresh = await loop.run_in_executor(None, self.build, entries)
+        except Exception as e:
+            logger.error(f"Errore costruzione indice inline: {e}")
+            return
+        self.replace(fresh)
+        logger.info(f"Indice inline pronto: {len(self.items)} gruppi, {len(self.prefixes)} prefissi")
+    
+    def search(self, text, limit=INLINE_RESULTS):
+        text = ' '.join(text.lower().split())[:self.max_prefix]
+        if not text:
+            return []
+        keys = self.prefixes.get(text)
+        if keys is None:
+            # Piu' parole: usa la parola piu' lunga e verifica le altre nel nome
+            words = text.split()
+            longest = max(words, key=len)
+            keys = [
+                key for key in self.prefixes.get(longest[:self.max_prefix], [])
+                if all(word in (self.items[key][1]['title'] or '').lower() for word in words)
+            ]
+        return [self.items[key][1] for key in keys[:limit]]
+
+class SearchCache:
+    """Cache a due livelli davanti a search_groups_web.
+    
+    1. LRU in memoria: fresca entro CACHE_TTL; fino a CACHE_STALE_TTL viene
+       servita subito mentre un task in background la aggiorna.
+    2. SQLite: gruppi salvati per la stessa query negli ultimi DB_CACHE_TTL secondi.
+    Solo in caso di miss su entrambi si interrogano le fonti web.
+    """
+    def __init__(self, searcher, database, queue, index=None, max_size=CACHE_SIZE, ttl=CACHE_TTL,
+                 stale_ttl=CACHE_STALE_TTL, db_ttl=DB_CACHE_TTL):
+        self.searcher = searcher
+        self.db = database
+        self.queue = queue
+        self.index = index
+        self.memory = LRUCache(max_size)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.db_ttl = db_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.flight = SingleFlight()
+    
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.db_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'evictions': self.memory.evictions,
+            'refreshes': self.refreshes,
+            'size': len(self.memory.entries),
+            'hit_ratio': round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+            'coalesced': self.flight.shared,
+        }
+    
+    async def search(self, query, limit=15):
+        key = normalize_query(query)
+        
+        cached = self.memory.get(key)
+        if cached:
+            results, age = cached
+            if age < self.ttl:
+                self.hits += 1
+                return results[:limit]
+            if age < self.stale_ttl:
+                # Stale-while-revalidate: risposta immediata, aggiornamento in background
+                self.stale_hits += 1
+                self._schedule_refresh(key, limit)
+                return results[:limit]
+            self.memory.discard(key)
+        
+        rows = await self.db.run(self.db.get_recent_groups, key, self.db_ttl, limit)
+        if rows:
+            self.db_hits += 1
+            results = [row_to_result(*row) for row in rows]
+            self.memory.set(key, results)
+            return results
+        
+        self.misses += 1
+        # Ricerche identiche concorrenti condividono un'unica chiamata alle fonti
+        return await self.flight.do(key, self._fetch, key, limit)
+    
+    async def _fetch(self, key, limit):
+        results = await self.searcher.search_groups_web(key, limit)
+        if results:
+            self.memory.set(key, results)
+            # Salva risultati nel database (scrittura differita a batch)
+            for result in results:
+                self.queue.add_group(
+                    result.get('title', ''),
+                    result.get('username', ''),
+                    result.get('description', ''),
+                    result.get('members', '0'),
+                    'group',
+                    result.get('link', ''),
+                    key
+                )
+                if self.index is not None:
+                    self.index.add(
+                        normalize_group_key(result.get('username', ''), result.get('link', ''),
+                                            result.get('title', '')),
+                        result.get('title', ''),
+                        result.get('username', ''),
+                        result.get('members'),
+                        result.get('link', '')
+                    )
+        return results
+    
+    def _schedule_refresh(self, key, limit):
+        if key in self.flight.inflight:
+            return
+        self.refreshes += 1
+        task = asyncio.ensure_future(self.flight.do(key, self._fetch, key, limit))
+        task.add_done_callback(lambda t: self._refresh_done(key, t))
+    
+    def _refresh_done(self, key, task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Errore aggiornamento cache per '{key}': {task.exception()}")
+
+class ResultPages:
+    """Insiemi di risultati di /cerca tenuti in memoria per la paginazione.
+    
+    I bottoni avanti/indietro contengono solo l'id numerico dell'insieme e il
+    numero di pagina; le pagine oltre i risultati gia' noti si leggono da searched_groups
+    con paginazione keyset (mai OFFSET), scartando i gruppi gia' mostrati.
+    """
+    def __init__(self, database, max_size=RESULT_PAGES_SIZE, ttl=RESULT_PAGES_TTL,
+                 per_page=RESULTS_PER_PAGE):
+        self.db = database
+        self.entries = LRUCache(max_size)
+        self.ttl = ttl
+        self.per_page = per_page
+        # Id unici anche tra riavvii: un vecchio bottone "Avanti" non deve puntare
+        # all'insieme di un'altra ricerca ma risultare scaduto
+        self._ids = itertools.count(int(time.time()) << 16)
+    
+    def create(self, query, results, min_members=None, max_members=None, query_id=None):
+        result_id = next(self._ids)
+        self.entries.set(result_id, {
+            'query': query,
+            'query_id': query_id,
+            'results': list(results),
+            'keys': {normalize_group_key(r.get('username', ''), r.get('link', ''), r.get('title', ''))
+                     for r in results},
+            'min_members': min_members,
+            'max_members': max_members,
+            'cursor': None,
+            'exhausted': False,
+        })
+        return result_id
+    
+    def get(self, result_id):
+        cached = self.entries.get(result_id)
+        if not cached:
+            return None
+        entry, age = cached
+        if age > self.ttl:
+            self.entries.discard(result_id)
+            return None
+        return entry
+    
+    async def ensure(self, entry, count):
+        """Carica dal database risultati finche' l'insieme ne contiene almeno ``count``"""
+        while len(entry['results']) < count and not entry['exhausted']:
+            rows = await self.db.run(
+                self.db.get_groups_page, entry['query'], entry['cursor'], self.per_page * 2,
+                entry['min_members'], entry['max_members'])
+            if not rows:
+                entry['exhausted'] = True
+                break
+            for row_id, name, username, description, members, link in rows:
+                entry['cursor'] = (members, row_id)
+                key = normalize_group_key(username, link, name)
+                if key not in entry['keys']:
+                    entry['keys'].add(key)
+                    entry['results'].append(row_to_result(name, username, description, members, link))
+    
+    async def page(self, result_id, page):
+        """Restituisce (entry, risultati della pagina, c'e' una pagina successiva) oppure None"""
+        entry = self.get(result_id)
+        if entry is None:
+            return None
+        start = page * self.per_page
+        # Un risultato in piu' per sapere se mostrare "Avanti"
+        await self.ensure(entry, start + self.per_page + 1)
+        results = entry['results'][start:start + self.per_page]
+        return entry, results, len(entry['results']) > start + self.per_page
+
+result_pages = ResultPages(db)
+inline_index = PrefixIndex()
+search_cache = SearchCache(searcher, db, write_queue, inline_index)
+
+class AggregateViews:
+    """Snapshot in memoria di trending e categorie, ricalcolato periodicamente.
+    
+    I handler leggono ``trending`` e ``categories`` senza interrogare il
+    database; il task di background aggiorna le tabelle aggregate in modo
+    incrementale e poi sostituisce lo snapshot.
+    """
+    def __init__(self, database, queue, interval=AGGREGATE_INTERVAL):
+        self.db = database
+        self.queue = queue
+        self.interval = interval
+        self.trending = []
+        self.categories = {}
+        self.refreshed_at = None
+        self._task = None
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._periodic_refresh())
+    
+    async def refresh(self):
+        # Il limite superiore viene fissato prima del flush: tutte le righe
+        # con data precedente sono gia' su disco quando si aggrega
+        until = datetime.now()
+        await self.queue.flush()
+        await self.db.run(self.db.refresh_aggregates, until)
+        self.trending, self.categories = await self.db.run(self.db.load_views)
+        self.refreshed_at = until
+    
+    async def _periodic_refresh(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Errore aggiornamento viste trending/categorie: {e}")
+            await asyncio.sleep(self.interval)
+    
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+views = AggregateViews(db, write_queue)
+
+class DeferredReply:
+    """Risposta con messaggio di caricamento differito.
+    
+    Il testo di caricamento viene inviato solo dopo ``delay`` secondi: se il
+    risultato arriva prima, ``edit_text`` invia direttamente la risposta finale
+    (un solo messaggio invece di invio + modifica).
+    """
+    def __init__(self, scheduler, message, loading_text, delay=LOADING_DELAY):
+        self.scheduler = scheduler
+        self.message = message
+        self.loading_text = loading_text
+        self.sent = None
+        self._sending = False
+        self._task = asyncio.create_task(self._send_loading(delay))
+    
+    async def _send_loading(self, delay):
+        await asyncio.sleep(delay)
+        self._sending = True
+        self.sent = await self.scheduler.reply_text(self.message, self.loading_text)
+    
+    async def edit_text(self, text, **kwargs):
+        if not self._sending:
+            self._task.cancel()
+            self._sending = True
+            self.scheduler.coalesced += 1
+            self.sent = await self.scheduler.reply_text(self.message, text, **kwargs)
+            return self.sent
+        if not self._task.cancelled():
+            try:
+                await self._task
+            except TelegramError as e:
+                logger.warning(f"Invio messaggio di caricamento fallito: {e}")
+        if self.sent is None:
+            self.sent = await self.scheduler.reply_text(self.message, text, **kwargs)
+            return self.sent
+        return await self.scheduler.call(self.message.chat_id, self.sent.edit_text, text, **kwargs)
+
+class OutboundScheduler:
+    """Punto unico di invio verso Telegram.
+    
+    Applica un token bucket globale e uno per chat, attende e ritenta in caso
+    di ``RetryAfter`` (flood wait) sospendendo gli invii verso quella chat.
+    """
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_RATE, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_chats = max_chats
+        self.chat_buckets = OrderedDict()
+        self.paused_until = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.dropped = 0
+    
+    def stats(self):
+        return {'sent': self.sent, 'coalesced': self.coalesced, 'retry_after': self.retries,
+                'dropped': self.dropped}
+    
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Gli id negativi sono gruppi/canali
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, 3)
+            if len(self.chat_buckets) > self.max_chats:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+    
+    async def call(self, chat_id, method, *args, **kwargs):
+        """Esegue un metodo di invio/modifica rispettando i limiti di flood"""
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            pause = self.paused_until.get(chat_id, 0) - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with tracer.span("outbound.send", method=method.__name__, chat_id=chat_id, attempt=attempt):
+                    result = await method(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                if attempt == OUTBOUND_MAX_RETRIES:
+                    raise
+                self.retries += 1
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"Flood wait di {retry_after}s per la chat {chat_id}")
+                self.paused_until[chat_id] = time.monotonic() + retry_after
+            except TelegramError:
+                metrics.inc('bot_errors_total', where='outbound')
+                raise
+            finally:
+                metrics.observe('bot_outbound_seconds', time.perf_counter() - start, method=method.__name__)
+                if self.paused_until.get(chat_id, 0) <= time.monotonic():
+                    self.paused_until.pop(chat_id, None)
+    
+    async def try_call(self, chat_id, method, *args, **kwargs):
+        """Come ``call`` ma senza mai attendere: se la chat e' in pausa o senza token
+        l'invio viene scartato (None). Per messaggi accessori, es. sotto sovraccarico."""
+        if self.paused_until.get(chat_id, 0) > time.monotonic():
+            self.dropped += 1
+            return None
+        if not self._chat_bucket(chat_id).try_acquire() or not self.global_bucket.try_acquire():
+            self.dropped += 1
+            return None
+        try:
+            result = await method(*args, **kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            self.retries += 1
+            self.paused_until[chat_id] = time.monotonic() + retry_after
+            self.dropped += 1
+            return None
+        self.sent += 1
+        return result
+    
+    async def reply_text(self, message, text, **kwargs):
+        return await self.call(message.chat_id, message.reply_text, text, **kwargs)
+    
+    async def edit_message_text(self, query, text, **kwargs):
+        return await self.call(query.message.chat_id, query.edit_message_text, text, **kwargs)
+    
+    def deferred_reply(self, message, loading_text):
+        return DeferredReply(self, message, loading_text)
+
+outbox = OutboundScheduler()
+
+# Telegram accetta al massimo 64 byte di callback_data
+CALLBACK_DATA_LIMIT = 64
+
+def encode_callback(action, *args):
+    """callback_data compatta: "<azione>" oppure "<azione>:<varint in base64url>"
+
+    Gli argomenti sono interi non negativi; le stringhe vanno prima internate
+    con ``interner.intern``.
+    """
+    if not args:
+        data = action
+    else:
+        payload = bytearray()
+        for value in args:
+            while True:
+                byte = value & 0x7F
+                value >>= 7
+                payload.append(byte | 0x80 if value else byte)
+                if not value:
+                    break
+        data = f"{action}:{base64.urlsafe_b64encode(bytes(payload)).decode().rstrip('=')}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data troppo lunga: {data}")
+    return data
+
+def decode_callback(data):
+    """Inverso di encode_callback: (azione, argomenti interi)"""
+    action, _, payload = data.partition(':')
+    if not payload:
+        return action, ()
+    raw = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+    args = []
+    value = shift = 0
+    for byte in raw:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            args.append(value)
+            value = shift = 0
+    return action, tuple(args)
+
+class CallbackInterner:
+    """Associa le stringhe utente (query, username) a id interi persistenti,
+    cosi' i bottoni restano entro i 64 byte anche dopo un riavvio"""
+    def __init__(self, database, max_size=10000):
+        self.db = database
+        self.ids = LRUCache(max_size)
+        self.values = LRUCache(max_size)
+    
+    def _remember(self, value, value_id):
+        self.ids.set(value, value_id)
+        self.values.set(value_id, value)
+    
+    async def intern(self, value):
+        cached = self.ids.get(value)
+        if cached:
+            return cached[0]
+        value_id = await self.db.run(self.db.intern_string, value)
+        self._remember(value, value_id)
+        return value_id
+    
+    async def lookup(self, value_id):
+        cached = self.values.get(value_id)
+        if cached:
+            return cached[0]
+        value = await self.db.run(self.db.lookup_string, value_id)
+        if value is not None:
+            self._remember(value, value_id)
+        return value
+
+interner = CallbackInterner(db)
+
+# Registro azione -> (handler, risposta automatica alla callback)
+CALLBACK_ACTIONS = {}
+
+def callback_action(name, answer=True):
+    """Registra un handler per i bottoni con azione ``name``.
+    
+    Con ``answer=False`` l'handler risponde da se' alla callback (es. con un avviso).
+    """
+    def register(func):
+        CALLBACK_ACTIONS[name] = (func, answer)
+        return func
+    return register
+
+WELCOME_TEXT = """
 🔍 **Bot Ricerca Gruppi Telegram**
 
 Trova facilmente gruppi Telegram per i tuoi interessi!
@@ -250,6 +2506,7 @@ Trova facilmente gruppi Telegram per i tuoi interessi!
 • `/info <@username>` - Info dettagliate di un gruppo
 • `/trending` - Gruppi di tendenza
 • `/categorie` - Cerca per categorie
+• `/preferiti` - Le tue ricerche e i gruppi salvati
 • `/help` - Guida completa
 
 **📌 Esempi:**
@@ -259,37 +2516,93 @@ Trova facilmente gruppi Telegram per i tuoi interessi!
 
 Inizia subito con una ricerca! 🚀
     """
+
+def start_keyboard():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔍 Cerca Gruppi", callback_data=encode_callback("search_prompt"))],
+        [InlineKeyboardButton("📊 Categorie", callback_data=encode_callback("categories")), 
+         InlineKeyboardButton("🔥 Trending", callback_data=encode_callback("trending"))],
+        [InlineKeyboardButton("❓ Aiuto", callback_data=encode_callback("help"))]
+    ])
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler per il comando /start"""
+    await outbox.reply_text(update.message, WELCOME_TEXT, reply_markup=start_keyboard(), parse_mode=ParseMode.MARKDOWN)
+
+def render_results_page(entry, result_id, page, results, has_next):
+    """Testo e bottoni di una pagina di risultati di /cerca"""
+    query = entry['query']
+    response = f"🎯 **Risultati per:** `{query}`\n"
+    if page == 0:
+        response += f"📊 **Trovati:** {len(entry['results'])}{'+' if has_next else ''} gruppi\n\n"
+    else:
+        response += f"📄 **Pagina {page + 1}**\n\n"
     
-    keyboard = [
-        [InlineKeyboardButton("🔍 Cerca Gruppi", callback_data="search_prompt")],
-        [InlineKeyboardButton("📊 Categorie", callback_data="categories"), 
-         InlineKeyboardButton("🔥 Trending", callback_data="trending")],
-        [InlineKeyboardButton("❓ Aiuto", callback_data="help")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    start = page * RESULTS_PER_PAGE
+    for i, group in enumerate(results, start + 1):
+        title = group.get('title') or 'Senza titolo'
+        username = group.get('username', '')
+        description = (group.get('description') or 'Nessuna descrizione')[:80]
+        members = format_members(group.get('members'))
+        link = group.get('link', '')
+        
+        response += f"**{i}. {title}**\n"
+        if username:
+            response += f"🆔 @{username}\n"
+        response += f"👥 {members} membri\n"
+        response += f"📝 {description}...\n"
+        if link:
+            response += f"🔗 [Unisciti]({link})\n"
+        response += "\n"
+    
+    response += "Usa `/info @username` per dettagli specifici"
     
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    # Bottoni di navigazione e azione
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Indietro", callback_data=encode_callback("pg", result_id, page - 1)))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Avanti ➡️", callback_data=encode_callback("pg", result_id, page + 1)))
+    keyboard = [navigation] if navigation else []
+    keyboard += [
+        [InlineKeyboardButton("🔄 Nuova Ricerca", callback_data=encode_callback("search_prompt"))],
+        [InlineKeyboardButton("💾 Salva Preferiti", callback_data=encode_callback("ss", entry['query_id']))]
+    ]
+    return response, InlineKeyboardMarkup(keyboard)
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per il comando /cerca"""
-    if not context.args:
-        await update.message.reply_text(
+    query, min_members, max_members = parse_search_args(context.args or [])
+    if not query:
+        await outbox.reply_text(
+            update.message,
             "❌ **Specifica cosa cercare!**\n\n"
             "Esempio: `/cerca crypto`\n"
-            "Esempio: `/cerca milano calcio`", 
+            "Esempio: `/cerca milano calcio`\n"
+            "Esempio: `/cerca crypto min:1000 max:50K`", 
             parse_mode=ParseMode.MARKDOWN
         )
         return
     
-    query = " ".join(context.args)
     user_id = update.effective_user.id
     
     # Messaggio di caricamento
-    loading_msg = await update.message.reply_text("🔍 Ricerca in corso... ⏳")
+    loading_msg = outbox.deferred_reply(update.message, "🔍 Ricerca in corso... ⏳")
     
     try:
-        # Cerca gruppi
-        results = await searcher.search_groups_web(query)
+        # Cerca gruppi (cache in memoria, poi SQLite, poi fonti web)
+        results = await search_cache.search(query)
+        
+        if min_members is not None or max_members is not None:
+            # Il catalogo si filtra in SQL su idx_searched_groups_rank; i pochi risultati
+            # appena trovati, forse ancora in coda di scrittura, restano un filtro in memoria
+            # (nessun flush forzato della coda)
+            results = filter_members(results, min_members, max_members)
+            rows = await db.run(db.get_saved_groups, query, 15, min_members, max_members)
+            results = merge_results(results, [
+                row_to_result(name, username, description, members, link)
+                for name, username, description, members, _, link in rows
+            ], 15)
         
         if not results:
             await loading_msg.edit_text(
@@ -302,51 +2615,13 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Salva risultati nel database
-        for result in results:
-            db.save_group(
-                result.get('title', ''),
-                result.get('username', ''),
-                result.get('description', ''),
-                result.get('members', '0'),
-                'group',
-                result.get('link', ''),
-                query
-            )
-        
         # Salva ricerca
-        db.save_search(user_id, query, len(results))
-        
-        # Prepara risposta
-        response = f"🎯 **Risultati per:** `{query}`\n"
-        response += f"📊 **Trovati:** {len(results)} gruppi\n\n"
-        
-        for i, group in enumerate(results[:8], 1):
-            title = group.get('title', 'Senza titolo')
-            username = group.get('username', '')
-            description = group.get('description', 'Nessuna descrizione')[:80]
-            members = group.get('members', 'N/A')
-            link = group.get('link', '')
-            
-            response += f"**{i}. {title}**\n"
-            if username:
-                response += f"🆔 @{username}\n"
-            response += f"👥 {members} membri\n"
-            response += f"📝 {description}...\n"
-            if link:
-                response += f"🔗 [Unisciti]({link})\n"
-            response += "\n"
-        
-        if len(results) > 8:
-            response += f"➕ **E altri {len(results) - 8} gruppi...**\n"
-            response += "Usa `/info @username` per dettagli specifici"
-        
-        # Bottoni azione
-        keyboard = [
-            [InlineKeyboardButton("🔄 Nuova Ricerca", callback_data="search_prompt")],
-            [InlineKeyboardButton("💾 Salva Preferiti", callback_data=f"save_search_{query}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        write_queue.add_search(user_id, query, len(results))
+        
+        query_id = await interner.intern(normalize_query(query))
+        result_id = result_pages.create(query, results, min_members, max_members, query_id)
+        entry, page_results, has_next = await result_pages.page(result_id, 0)
+        response, reply_markup = render_results_page(entry, result_id, 0, page_results, has_next)
         
         await loading_msg.edit_text(response, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
         
@@ -357,7 +2632,8 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per il comando /info"""
     if not context.args:
-        await update.message.reply_text(
+        await outbox.reply_text(
+            update.message,
             "❌ **Specifica un gruppo!**\n\n"
             "Esempio: `/info @cryptoitalia`\n"
             "Esempio: `/info https://t.me/cryptoitalia`",
@@ -366,7 +2642,7 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     group_identifier = context.args[0]
-    loading_msg = await update.message.reply_text("ℹ️ Recupero informazioni... ⏳")
+    loading_msg = outbox.deferred_reply(update.message, "ℹ️ Recupero informazioni... ⏳")
     
     try:
         group_info = await searcher.get_group_info(group_identifier)
@@ -388,8 +2664,9 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             response += f"🔗 **[Unisciti al Gruppo]({group_info['invite_link']})**"
         
         keyboard = [
-            [InlineKeyboardButton("🔍 Cerca Altri", callback_data="search_prompt")],
-            [InlineKeyboardButton("💾 Salva", callback_data=f"save_group_{group_info.get('username', '')}")]
+            [InlineKeyboardButton("🔍 Cerca Altri", callback_data=encode_callback("search_prompt"))],
+            [InlineKeyboardButton("💾 Salva", callback_data=encode_callback(
+                "sg", await interner.intern(group_info.get('username', ''))))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -399,30 +2676,36 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Errore recupero info: {e}")
         await loading_msg.edit_text("❌ Errore nel recuperare le informazioni.")
 
+# Mostrati finche' la prima aggregazione non ha prodotto dati
+DEFAULT_TRENDING = [
+    {"title": "Crypto Italia", "username": "cryptoitalia", "members": "45.2K", "category": "💰 Crypto"},
+    {"title": "Tech News Italia", "username": "technewsit", "members": "38.7K", "category": "💻 Tech"},
+    {"title": "Gaming Community", "username": "gaming_ita", "members": "29.1K", "category": "🎮 Gaming"},
+    {"title": "Milano Eventi", "username": "milanoeventi", "members": "22.5K", "category": "🏙️ Città"},
+    {"title": "Startup Italia", "username": "startupitalia", "members": "18.9K", "category": "🚀 Business"},
+]
+
 async def trending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handler per gruppi di tendenza"""
-    trending_groups = [
-        {"title": "Crypto Italia", "username": "cryptoitalia", "members": "45.2K", "category": "💰 Crypto"},
-        {"title": "Tech News Italia", "username": "technewsit", "members": "38.7K", "category": "💻 Tech"},
-        {"title": "Gaming Community", "username": "gaming_ita", "members": "29.1K", "category": "🎮 Gaming"},
-        {"title": "Milano Eventi", "username": "milanoeventi", "members": "22.5K", "category": "🏙️ Città"},
-        {"title": "Startup Italia", "username": "startupitalia", "members": "18.9K", "category": "🚀 Business"},
-    ]
+    """Handler per gruppi di tendenza (dallo snapshot precalcolato)"""
+    trending_groups = views.trending or DEFAULT_TRENDING
     
     response = "🔥 **Gruppi di Tendenza**\n\n"
     
     for i, group in enumerate(trending_groups, 1):
         response += f"**{i}. {group['title']}**\n"
-        response += f"{group['category']} • 👥 {group['members']}\n"
-        response += f"🔗 https://t.me/{group['username']}\n\n"
+        response += f"{group['category']} • 👥 {format_members(group['members'])}\n"
+        link = f"https://t.me/{group['username']}" if group.get('username') else group.get('link')
+        if link:
+            response += f"🔗 {link}\n"
+        response += "\n"
     
     keyboard = [
-        [InlineKeyboardButton("🔍 Cerca Specifico", callback_data="search_prompt")],
-        [InlineKeyboardButton("📊 Categorie", callback_data="categories")]
+        [InlineKeyboardButton("🔍 Cerca Specifico", callback_data=encode_callback("search_prompt"))],
+        [InlineKeyboardButton("📊 Categorie", callback_data=encode_callback("categories"))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(response, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    await outbox.reply_text(update.effective_message, response, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
 async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per le categorie"""
@@ -432,53 +2715,123 @@ async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 Scegli una categoria per trovare i migliori gruppi:
     """
     
-    keyboard = [
-        [InlineKeyboardButton("💰 Crypto", callback_data="cat_crypto"), 
-         InlineKeyboardButton("💻 Tech", callback_data="cat_tech")],
-        [InlineKeyboardButton("🎮 Gaming", callback_data="cat_gaming"), 
-         InlineKeyboardButton("📚 Studio", callback_data="cat_studio")],
-        [InlineKeyboardButton("🏙️ Città", callback_data="cat_citta"), 
-         InlineKeyboardButton("🍕 Food", callback_data="cat_food")],
-        [InlineKeyboardButton("⚽ Sport", callback_data="cat_sport"), 
-         InlineKeyboardButton("🎵 Musica", callback_data="cat_musica")],
-        [InlineKeyboardButton("🎬 Cinema", callback_data="cat_cinema"), 
-         InlineKeyboardButton("🚗 Auto", callback_data="cat_auto")],
-        [InlineKeyboardButton("🔍 Ricerca Libera", callback_data="search_prompt")]
+    # Due categorie per riga; il bottone contiene l'indice della categoria
+    buttons = [
+        InlineKeyboardButton(label, callback_data=encode_callback("cat", index))
+        for index, (label, _) in enumerate(CATEGORIES.values())
     ]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    keyboard.append([InlineKeyboardButton("🔍 Ricerca Libera", callback_data=encode_callback("search_prompt"))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(categories_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    await outbox.reply_text(update.effective_message, categories_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handler per i callback dei bottoni"""
+    """Handler per i callback dei bottoni: decodifica e smista tramite CALLBACK_ACTIONS"""
     query = update.callback_query
-    await query.answer()
-    
-    if query.data == "search_prompt":
-        await query.edit_message_text(
-            "🔍 **Inizia una ricerca**\n\n"
-            "Scrivi: `/cerca <quello che cerchi>`\n\n"
-            "**Esempi:**\n"
-            "• `/cerca crypto bitcoin`\n"
-            "• `/cerca roma calcio`\n"
-            "• `/cerca programmazione python`",
-            parse_mode=ParseMode.MARKDOWN
-        )
+    try:
+        action, args = decode_callback(query.data or '')
+    except (binascii.Error, ValueError):
+        action, args = None, ()
     
-    elif query.data == "categories":
-        await categories_command(update, context)
+    handler, answer = CALLBACK_ACTIONS.get(action, (None, True))
+    if handler is None:
+        await query.answer("⚠️ Bottone non più valido, ripeti il comando.")
+        return
+    with observe_handler(f"callback_{action}"):
+        if answer:
+            await query.answer()
+        await handler(update, context, *args)
+
+@callback_action("search_prompt")
+async def search_prompt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await outbox.edit_message_text(
+        update.callback_query,
+        "🔍 **Inizia una ricerca**\n\n"
+        "Scrivi: `/cerca <quello che cerchi>`\n\n"
+        "**Esempi:**\n"
+        "• `/cerca crypto bitcoin`\n"
+        "• `/cerca roma calcio`\n"
+        "• `/cerca programmazione python`",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+@callback_action("start_menu")
+async def start_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await outbox.edit_message_text(update.callback_query, WELCOME_TEXT, reply_markup=start_keyboard(),
+                                   parse_mode=ParseMode.MARKDOWN)
+
+@callback_action("categories")
+async def categories_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await categories_command(update, context)
+
+@callback_action("trending")
+async def trending_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await trending_command(update, context)
+
+@callback_action("pg")
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, result_id=0, page=0):
+    query = update.callback_query
+    loaded = await result_pages.page(result_id, page)
+    if not loaded:
+        await outbox.edit_message_text(query, "⌛ Risultati scaduti, ripeti la ricerca con /cerca.")
+        return
+    entry, page_results, has_next = loaded
+    response, reply_markup = render_results_page(entry, result_id, page, page_results, has_next)
+    await outbox.edit_message_text(query, response, reply_markup=reply_markup,
+                                   parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
+@callback_action("cat")
+async def category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, index=0):
+    query = update.callback_query
+    keys = list(CATEGORIES)
+    if index >= len(keys):
+        return
+    category = keys[index]
+    label = CATEGORIES[category][0]
+    groups = views.categories.get(category, [])
     
-    elif query.data == "trending":
-        await trending_command(update, context)
+    if not groups:
+        await outbox.edit_message_text(
+            query,
+            f"{label}\n\nNessun gruppo ancora in questa categoria.\n"
+            f"Prova: `/cerca {category}`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
     
-    elif query.data.startswith("cat_"):
-        category = query.data.replace("cat_", "")
-        # Simula ricerca per categoria
-        await query.edit_message_text(f"🔍 Ricerca per categoria: {category}")
-        # Qui implementeresti la ricerca specifica per categoria
+    response = f"{label} • **Gruppi più popolari**\n\n"
+    for i, group in enumerate(groups, 1):
+        response += f"**{i}. {group['title']}**\n"
+        if group['username']:
+            response += f"🆔 @{group['username']}\n"
+        response += f"👥 {format_members(group['members'])} membri\n"
+        if group['link']:
+            response += f"🔗 [Unisciti]({group['link']})\n"
+        response += "\n"
     
-    elif query.data == "help":
-        help_text = """
+    keyboard = [[InlineKeyboardButton("📊 Categorie", callback_data=encode_callback("categories"))]]
+    await outbox.edit_message_text(query, response, reply_markup=InlineKeyboardMarkup(keyboard),
+                                   parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
+async def _save_favorite(update: Update, kind, value_id):
+    query = update.callback_query
+    value = await interner.lookup(value_id)
+    if not value:
+        await query.answer("⚠️ Elemento non più disponibile.")
+        return
+    added = await db.run(db.add_favorite, update.effective_user.id, kind, value)
+    await query.answer("✅ Salvato nei preferiti! Usa /preferiti" if added else "ℹ️ Già nei preferiti")
+
+@callback_action("ss", answer=False)
+async def save_search_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, query_id=0):
+    await _save_favorite(update, 'search', query_id)
+
+@callback_action("sg", answer=False)
+async def save_group_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, username_id=0):
+    await _save_favorite(update, 'group', username_id)
+
+HELP_TEXT = """
 ❓ **Guida Completa**
 
 **🔍 Comandi di Ricerca:**
@@ -486,6 +2839,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/info <@username>` - Info dettagliate
 • `/trending` - Gruppi popolari
 • `/categorie` - Naviga per categorie
+• `/preferiti` - Ricerche e gruppi salvati
 
 **💡 Consigli per Ricerche Efficaci:**
 • Usa parole chiave specifiche
@@ -499,47 +2853,491 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 **⚡ Funzioni Avanzate:**
 • Salvataggio ricerche preferite
-• Filtraggio per numero membri
+• Filtraggio per numero membri (`min:1000 max:50K`)
 • Controllo gruppi verificati
-        """
-        
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data="start_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(help_text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+"""
+
+def help_keyboard():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Indietro", callback_data=encode_callback("start_menu"))]])
+
+@callback_action("help")
+async def help_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await outbox.edit_message_text(update.callback_query, HELP_TEXT, reply_markup=help_keyboard(),
+                                   parse_mode=ParseMode.MARKDOWN)
+
+async def favorites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler per il comando /preferiti"""
+    favorites = await db.run(db.get_favorites, update.effective_user.id)
+    if not favorites:
+        await outbox.reply_text(update.message, "💾 Non hai ancora salvato nulla.\n"
+                                "Usa il bottone **Salva** sotto i risultati di /cerca o /info.",
+                                parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    searches = [value for kind, value in favorites if kind == 'search']
+    groups = [value for kind, value in favorites if kind == 'group']
+    response = "💾 **I tuoi preferiti**\n\n"
+    if searches:
+        response += "**🔍 Ricerche:**\n"
+        response += "".join(f"• `/cerca {value}`\n" for value in searches) + "\n"
+    if groups:
+        response += "**👥 Gruppi:**\n"
+        response += "".join(f"• @{value}\n" for value in groups)
+    
+    await outbox.reply_text(update.message, response, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler per la modalità inline: suggerimenti dall'indice dei prefissi in memoria"""
+    text = update.inline_query.query
+    results = []
+    for group in inline_index.search(text):
+        username = group['username'] or ''
+        link = group['link'] or (f"https://t.me/{username}" if username else '')
+        members = format_members(group['members'])
+        message = f"**{group['title']}**\n👥 {members} membri"
+        if link:
+            message += f"\n🔗 [Unisciti]({link})"
+        results.append(InlineQueryResultArticle(
+            id=hashlib.md5(f"{group['title']}|{link}".encode()).hexdigest(),
+            title=group['title'] or username,
+            description=f"👥 {members}" + (f" • @{username}" if username else ''),
+            url=link or None,
+            input_message_content=InputTextMessageContent(
+                message, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+        ))
+    
+    await update.inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        button=None if results else InlineQueryResultsButton("🔍 Cerca con /cerca", start_parameter="inline")
+    )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler per il comando /help"""
-    await button_callback(update, context)
+    await outbox.reply_text(update.message, HELP_TEXT, reply_markup=help_keyboard(), parse_mode=ParseMode.MARKDOWN)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Elabora gli update in parallelo mantenendo l'ordine all'interno di ogni chat.
+    
+    - al massimo ``workers`` handler in esecuzione contemporaneamente;
+    - gli update della stessa chat vengono serializzati (lock FIFO per chat);
+    - oltre ``max_pending`` update accettati i nuovi vengono scartati con una
+      risposta "occupato, riprova".
+    """
+    def __init__(self, workers=UPDATE_WORKERS, max_pending=MAX_PENDING_UPDATES):
+        # Il semaforo di PTB non deve mai accodare: la coda la gestiamo noi
+        super().__init__(max_pending * 2)
+        self.workers = asyncio.Semaphore(workers)
+        self.max_pending = max_pending
+        self.chat_locks = {}
+        self.pending = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.processed = 0
+        self.shed = 0
+        self.wait_stats = LatencyStats()
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    def stats(self):
+        return {
+            'queue_depth': self.pending - self.running,
+            'running': self.running,
+            'max_queue_depth': self.max_queue_depth,
+            'processed': self.processed,
+            'shed': self.shed,
+            'wait_p50_ms': round(self.wait_stats.percentile(50) * 1000, 1),
+            'wait_p99_ms': round(self.wait_stats.percentile(99) * 1000, 1),
+        }
+    
+    async def do_process_update(self, update, coroutine):
+        if self.pending >= self.max_pending:
+            coroutine.close()
+            self.shed += 1
+            await self._reply_busy(update)
+            return
+        
+        chat = update.effective_chat if isinstance(update, Update) else None
+        chat_id = chat.id if chat else None
+        self.pending += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.pending - self.running)
+        queued_at = time.perf_counter()
+        lock = self._acquire_chat_lock(chat_id)
+        try:
+            async with lock, self.workers:
+                self.wait_stats.record(time.perf_counter() - queued_at)
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+        finally:
+            self.pending -= 1
+            self._release_chat_lock(chat_id)
+    
+    def _acquire_chat_lock(self, chat_id):
+        if chat_id is None:
+            return contextlib.nullcontext()
+        entry = self.chat_locks.get(chat_id)
+        if entry is None:
+            entry = self.chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+    
+    def _release_chat_lock(self, chat_id):
+        entry = self.chat_locks.get(chat_id)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self.chat_locks[chat_id]
+    
+    async def _reply_busy(self, update):
+        text = "⏳ Il bot è molto occupato in questo momento, riprova tra qualche secondo."
+        chat_id = update.effective_chat.id if update.effective_chat else 0
+        try:
+            # Passa dallo scheduler senza attendere: sotto sovraccarico meglio scartare che accodare
+            if update.callback_query:
+                await outbox.try_call(chat_id, update.callback_query.answer, text)
+            elif update.effective_message:
+                await outbox.try_call(chat_id, update.effective_message.reply_text, text)
+        except TelegramError as e:
+            logger.warning(f"Impossibile inviare risposta di sovraccarico: {e}")
+
+def runtime_metrics(application: Application):
+    """Contatori e gauge gia' tenuti dai vari componenti, letti al momento dello scrape"""
+    cache = search_cache.stats()
+    yield ('bot_cache_lookups_total', 'counter', "Ricerche servite dalla cache per esito", [
+        ({'result': result}, cache[key])
+        for result, key in (('hit', 'hits'), ('stale', 'stale_hits'), ('db', 'db_hits'), ('miss', 'misses'))
+    ])
+    yield ('bot_cache_hit_ratio', 'gauge', "Frazione di ricerche senza interrogare le fonti web",
+           [({}, cache['hit_ratio'])])
+    yield ('bot_cache_entries', 'gauge', "Voci nella cache in memoria", [({}, cache['size'])])
+    yield ('bot_cache_coalesced_total', 'counter', "Ricerche unite a una identica gia' in corso",
+           [({}, cache['coalesced'])])
+
+    sources = searcher.get_source_stats()
+    yield ('bot_source_requests_total', 'counter', "Richieste alle fonti web",
+           [({'source': name}, stats['calls']) for name, stats in sources.items()])
+    yield ('bot_source_failures_total', 'counter', "Errori e timeout delle fonti web", [
+        ({'source': name, 'kind': kind}, stats[key])
+        for name, stats in sources.items() for kind, key in (('error', 'errors'), ('timeout', 'timeouts'))
+    ])
+    yield ('bot_source_skipped_total', 'counter', "Richieste saltate per breaker aperto o rate limit", [
+        ({'source': name, 'reason': reason}, stats[key])
+        for name, stats in sources.items() for reason, key in (('breaker', 'skipped'), ('throttled', 'throttled'))
+    ])
+    yield ('bot_source_breaker_open', 'gauge', "1 se il circuit breaker della fonte non e' chiuso",
+           [({'source': name}, int(stats['breaker'] != 'closed')) for name, stats in sources.items()])
+
+    outbound = outbox.stats()
+    yield ('bot_outbound_sent_total', 'counter', "Chiamate di invio riuscite", [({}, outbound['sent'])])
+    yield ('bot_outbound_retry_after_total', 'counter', "Flood wait ricevuti da Telegram",
+           [({}, outbound['retry_after'])])
+    yield ('bot_outbound_dropped_total', 'counter', "Invii accessori scartati per limiti di flood",
+           [({}, outbound['dropped'])])
+    yield ('bot_db_rows_written_total', 'counter', "Righe scritte dalla coda di scritture differite",
+           [({}, write_queue.rows_written)])
+    yield ('bot_db_write_pending', 'gauge', "Righe in attesa di flush", [({}, write_queue.pending())])
+
+    processor = application.update_processor
+    if isinstance(processor, ChatOrderedUpdateProcessor):
+        stats = processor.stats()
+        yield ('bot_update_queue_depth', 'gauge', "Update in attesa di un worker", [({}, stats['queue_depth'])])
+        yield ('bot_updates_processed_total', 'counter', "Update elaborati", [({}, stats['processed'])])
+        yield ('bot_updates_shed_total', 'counter', "Update scartati per sovraccarico", [({}, stats['shed'])])
+
+async def metrics_endpoint(request: web.Request):
+    body = metrics.render(runtime_metrics(request.app['application']))
+    return web.Response(text=body, content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+async def traces_endpoint(request: web.Request):
+    """Ultimi span completati (solo con TRACE_SAMPLE > 0), filtrabili per ?trace_id="""
+    trace_id = request.query.get('trace_id')
+    spans = [span for span in list(tracer.spans) if not trace_id or span['trace_id'] == trace_id]
+    return web.json_response(spans)
+
+async def start_metrics_server(application: Application):
+    """Server HTTP locale per /metrics e /traces, separato dal webhook pubblico"""
+    web_app = web.Application()
+    web_app['application'] = application
+    web_app.router.add_get('/metrics', metrics_endpoint)
+    web_app.router.add_get('/traces', traces_endpoint)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_LISTEN, METRICS_PORT).start()
+    application.bot_data['metrics_runner'] = runner
+    logger.info(f"Metriche disponibili su http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+
+async def on_startup(application: Application):
+    """Hook di avvio: apre il pool di connessioni HTTP e avvia l'aggregazione periodica"""
+    await searcher.create_session()
+    # L'indice inline si costruisce in background: il webhook risponde subito
+    application.bot_data['inline_index_task'] = asyncio.create_task(inline_index.load(db))
+    views.start()
+    if METRICS_PORT:
+        await start_metrics_server(application)
+
+async def on_shutdown(application: Application):
+    """Hook di spegnimento: svuota le scritture in attesa e chiude le connessioni"""
+    task = application.bot_data.pop('inline_index_task', None)
+    if task and not task.done():
+        task.cancel()
+    runner = application.bot_data.pop('metrics_runner', None)
+    if runner:
+        await runner.cleanup()
+    await views.close()
+    await write_queue.close()
+    await searcher.close_session()
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Handler per gli errori"""
+    metrics.inc('bot_errors_total', where='update')
     logger.error(f"Update {update} caused error {context.error}")
 
-def main():
+async def webhook_update(request: web.Request):
+    """Riceve un update da Telegram e lo accoda all'Application"""
+    application = request.app['application']
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.Response()
+
+async def healthcheck(request: web.Request):
+    return web.Response(text="ok")
+
+async def run_webhook(application: Application):
+    """Avvia il bot in modalita' webhook con un server aiohttp"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    web_app = web.Application()
+    web_app['application'] = application
+    web_app.router.add_post(f'/{WEBHOOK_PATH}', webhook_update)
+    web_app.router.add_get('/health', healthcheck)
+    runner = web.AppRunner(web_app, access_log=None)
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=False
+        )
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN, PORT).start()
+        logger.info(f"Webhook in ascolto su {WEBHOOK_LISTEN}:{PORT}/{WEBHOOK_PATH}")
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+def register_handlers(application: Application):
+    """Aggiunge all'Application tutti gli handler del bot"""
+    application.add_handler(CommandHandler("start", timed_handler("start", start)))
+    application.add_handler(CommandHandler("help", timed_handler("help", help_command)))
+    application.add_handler(CommandHandler("cerca", timed_handler("cerca", search_command)))
+    application.add_handler(CommandHandler("info", timed_handler("info", info_command)))
+    application.add_handler(CommandHandler("trending", timed_handler("trending", trending_command)))
+    application.add_handler(CommandHandler("categorie", timed_handler("categorie", categories_command)))
+    application.add_handler(CommandHandler("preferiti", timed_handler("preferiti", favorites_command)))
+    # I bottoni vengono misurati per azione dentro button_callback
+    application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(InlineQueryHandler(timed_handler("inline", inline_query)))
+    
+    # Handler per gli errori
+    application.add_error_handler(error_handler)
+
+# Nomi di campo accettati in import oltre alle colonne (quelli dei risultati delle fonti web)
+CATALOG_ALIASES = {
+    'title': 'group_name',
+    'name': 'group_name',
+    'username': 'group_username',
+    'description': 'group_description',
+    'members': 'members_count',
+    'type': 'group_type',
+    'link': 'invite_link',
+    'verified': 'is_verified',
+}
+
+def catalog_format(path, fmt=None):
+    """Formato esplicito o dedotto dall'estensione (.csv / .jsonl, anche .gz)"""
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+def open_catalog(path, mode):
+    """Apre un catalogo in testo UTF-8: '-' e' stdin/stdout, i .gz sono compressi al volo"""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+def catalog_row(record, now):
+    """Converte un record del catalogo in una riga di CATALOG_COLUMNS (None se senza identita')"""
+    record = {CATALOG_ALIASES.get(key, key): value for key, value in record.items()}
+    key = normalize_group_key(record.get('group_username'), record.get('invite_link'), record.get('group_name'))
+    if not key:
+        return None
+    found_date = record.get('found_date') or now
+    return (
+        key,
+        record.get('group_name') or '',
+        (record.get('group_username') or '').strip().lstrip('@'),
+        record.get('group_description') or '',
+        parse_members(record.get('members_count')),
+        record.get('group_type') or '',
+        record.get('invite_link') or '',
+        normalize_query(record.get('search_query') or ''),
+        found_date,
+        record.get('last_seen') or found_date,
+        int(str(record.get('is_verified') or '').lower() in ('1', 'true', 'yes')),
+    )
+
+def read_catalog(path, fmt=None, counts=None):
+    """Legge in streaming un catalogo JSONL o CSV; le righe non valide vengono saltate e contate"""
+    counts = counts if counts is not None else {}
+    counts.setdefault('skipped', 0)
+    now = datetime.now()
+    with open_catalog(path, 'r') as f:
+        if catalog_format(path, fmt) == 'csv':
+            records = csv.DictReader(f)
+        else:
+            records = (line for line in f if line.strip())
+        for number, record in enumerate(records, 1):
+            try:
+                if isinstance(record, str):
+                    record = json.loads(record)
+                row = catalog_row(record, now)
+            except (ValueError, AttributeError) as e:
+                row = None
+                logger.warning(f"Riga {number} non valida: {e}")
+            if row is None:
+                counts['skipped'] += 1
+                continue
+            yield row
+
+def write_catalog(path, rows, fmt=None):
+    """Scrive in streaming le righe di iter_catalog in JSONL o CSV; restituisce il numero di righe"""
+    columns = GroupSearchDB.CATALOG_COLUMNS
+    written = 0
+    with open_catalog(path, 'w') as f:
+        if catalog_format(path, fmt) == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+                written += 1
+    return written
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bot Ricerca Gruppi Telegram")
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help="Avvia il bot (predefinito)")
+    run_parser.add_argument('--mode', choices=['polling', 'webhook'], default=BOT_MODE,
+                            help="Ricezione update: long polling o webhook HTTP")
+    subparsers.add_parser('compact', help="Elimina i gruppi duplicati e compatta il database")
+    import_parser = subparsers.add_parser(
+        'import', help="Importa un catalogo di gruppi (JSONL o CSV, anche .gz) a bot fermo")
+    import_parser.add_argument('path', help="File da importare ('-' per stdin)")
+    import_parser.add_argument('--format', choices=['jsonl', 'csv'], help="Predefinito: dall'estensione")
+    import_parser.add_argument('--chunk-size', type=int, default=50000, help="Righe per transazione")
+    export_parser = subparsers.add_parser('export', help="Esporta i gruppi salvati in JSONL o CSV")
+    export_parser.add_argument('path', help="File di destinazione ('-' per stdout)")
+    export_parser.add_argument('--format', choices=['jsonl', 'csv'], help="Predefinito: dall'estensione")
+    export_parser.add_argument('--chunk-size', type=int, default=10000, help="Righe lette per query")
+    snapshot_parser = subparsers.add_parser('snapshot', help="Copia coerente del database SQLite")
+    snapshot_parser.add_argument('path', help="File di destinazione")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Funzione principale"""
+    args = parse_args(argv)
+    if args.command == 'compact':
+        removed = db.compact()
+        print(f"🧹 Database compattato: {removed} duplicati rimossi")
+        db.close()
+        return
+    if args.command == 'import':
+        counts = {}
+        imported, merged = db.bulk_import(
+            read_catalog(args.path, args.format, counts), args.chunk_size,
+            progress=lambda n: logger.info(f"Import in corso: {n} righe"))
+        print(f"📥 Import completato: {imported} righe lette, {merged} duplicati uniti, "
+              f"{counts['skipped']} righe scartate")
+        db.close()
+        return
+    if args.command == 'export':
+        exported = write_catalog(args.path, db.iter_catalog(args.chunk_size), args.format)
+        # Su stdout il riepilogo finirebbe dentro l'export
+        print(f"📤 Export completato: {exported} gruppi", file=sys.stderr if args.path == '-' else sys.stdout)
+        db.close()
+        return
+    if args.command == 'snapshot':
+        db.snapshot(args.path)
+        print(f"📸 Snapshot salvato in {args.path}")
+        db.close()
+        return
+    
     if not BOT_TOKEN:
         print("❌ ERRORE: BOT_TOKEN non trovato nelle variabili d'ambiente!")
         return
     
-    # Crea l'applicazione
-    application = Application.builder().token(BOT_TOKEN).build()
+    mode = getattr(args, 'mode', BOT_MODE)
+    if mode == 'webhook' and not WEBHOOK_URL:
+        print("❌ ERRORE: WEBHOOK_URL non impostato per la modalità webhook!")
+        return
     
-    # Aggiungi gli handler
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("cerca", search_command))
-    application.add_handler(CommandHandler("info", info_command))
-    application.add_handler(CommandHandler("trending", trending_command))
-    application.add_handler(CommandHandler("categorie", categories_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
+    # Crea l'applicazione (update processati in parallelo, in ordine per chat)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
-    # Handler per gli errori
-    application.add_error_handler(error_handler)
+    register_handlers(application)
     
     # Avvia il bot
-    print("🚀 Bot Ricerca Gruppi avviato!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    print(f"🚀 Bot Ricerca Gruppi avviato! (modalità {mode})")
+    if mode == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+    db.close()
 
 if __name__ == '__main__':
     main()